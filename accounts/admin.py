@@ -1,3 +1,19 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 
-# Register your models here.
+from .models import ApiToken
+
+
+@admin.register(ApiToken)
+class ApiTokenAdmin(admin.ModelAdmin):
+    list_display = ('name', 'prefix', 'user', 'created_at', 'last_used_at')
+    list_select_related = ('user',)
+    search_fields = ('name', 'prefix', 'user__username')
+    readonly_fields = ('prefix', 'created_at', 'last_used_at')
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            key = obj.generate_key()
+            messages.warning(
+                request, f'The new API token is {key} - it is not shown again.'
+            )
+        super().save_model(request, obj, form, change)
@@ -0,0 +1,29 @@
+from functools import wraps
+
+from django.http import JsonResponse
+
+from .models import ApiToken
+
+
+def get_token_user(request):
+    """Returns the user of the `Authorization: Bearer <token>` header."""
+    scheme, _, key = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if scheme.lower() not in ('bearer', 'token') or not key:
+        return None
+    return ApiToken.get_user(key.strip())
+
+
+def token_required(view_func):
+    """Authenticates the request with an API token instead of a session."""
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        user = get_token_user(request)
+        if user is None:
+            response = JsonResponse(
+                {'error': 'Invalid or missing API token.'}, status=401
+            )
+            response['WWW-Authenticate'] = 'Bearer'
+            return response
+        request.user = user
+        return view_func(request, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,24 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import ApiToken
+
+
+class Command(BaseCommand):
+    help = 'Creates an API token for a user and prints it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument(
+            '--name', default='default', help='Name of the token.'
+        )
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        try:
+            user = User.objects.get(**{User.USERNAME_FIELD: options['username']})
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']} does not exist.")
+
+        _, key = ApiToken.create_token(user=user, name=options['name'])
+        self.stdout.write(key)
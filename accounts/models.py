@@ -1,3 +1,65 @@
+import hashlib
+import secrets
+
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
+
+
+class ApiToken(models.Model):
+    """Token for the JSON API, only a hash of the token is stored."""
+
+    PREFIX_LENGTH = 8
+    # last_used_at is written at most once per interval
+    USAGE_UPDATE_INTERVAL = timezone.timedelta(minutes=5)
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name='api_tokens',
+        on_delete=models.CASCADE
+    )
+    name = models.CharField(max_length=100)
+    prefix = models.CharField(max_length=PREFIX_LENGTH, editable=False)
+    key_hash = models.CharField(max_length=64, unique=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    def __str__(self):
+        return f'{self.name} ({self.prefix}...)'
+
+    @staticmethod
+    def hash_key(key):
+        # the keys are random, a fast hash is enough
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def generate_key(self):
+        """Sets a new key and returns it, the key itself is not stored."""
+        key = secrets.token_urlsafe(32)
+        self.prefix = key[:self.PREFIX_LENGTH]
+        self.key_hash = self.hash_key(key)
+        return key
+
+    @classmethod
+    def create_token(cls, user, name):
+        token = cls(user=user, name=name)
+        key = token.generate_key()
+        token.save()
+        return token, key
+
+    @classmethod
+    def get_user(cls, key):
+        try:
+            token = cls.objects.select_related('user').get(
+                key_hash=cls.hash_key(key)
+            )
+        except cls.DoesNotExist:
+            return None
+
+        now = timezone.now()
+        if (
+            token.last_used_at is None
+            or now - token.last_used_at > cls.USAGE_UPDATE_INTERVAL
+        ):
+            cls.objects.filter(pk=token.pk).update(last_used_at=now)
 
-# Create your models here.
+        return token.user if token.user.is_active else None
@@ -0,0 +1,296 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+import httpx
+from django.utils import timezone
+
+from .health import HEALTH_ERROR, HEALTH_INVALID, HEALTH_OK
+
+logger = logging.getLogger(__name__)
+
+
+APP_NAME = 'Audible'
+APP_VERSION = '3.56.2'
+
+TRANSIENT_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class AsyncRateLimiter:
+    """Lets at most `rate` calls per second pass :meth:`acquire`."""
+
+    def __init__(self, rate: Optional[float] = None) -> None:
+        self._interval = 1 / rate if rate else 0.0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if not self._interval:
+            return
+
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self._interval
+
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class MarketplaceRateLimiter:
+    """Holds one :class:`AsyncRateLimiter` per marketplace domain.
+
+    The limits only apply within this process. `device_id` is accepted for
+    compatibility with :class:`devices.ratelimit.SharedRateLimiter`.
+    """
+
+    def __init__(self, rate: Optional[float] = None) -> None:
+        self._rate = rate
+        self._limiters: Dict[str, AsyncRateLimiter] = {}
+
+    async def acquire(self, domain: str, device_id=None) -> None:
+        if domain not in self._limiters:
+            self._limiters[domain] = AsyncRateLimiter(self._rate)
+        await self._limiters[domain].acquire()
+
+
+async def run_bounded(
+    func: Callable[[Any], Awaitable[Any]],
+    items: Iterable[Any],
+    concurrency: int = 20
+) -> List[Any]:
+    """Runs `func` for every item with at most `concurrency` running at once.
+
+    Items are pulled lazily by a fixed number of workers, so memory use does
+    not grow with the number of items. Results keep the order of `items`.
+    """
+    iterator = iter(enumerate(items))
+    results: Dict[int, Any] = {}
+
+    async def worker():
+        for index, item in iterator:
+            results[index] = await func(item)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+
+    return [results[index] for index in sorted(results)]
+
+
+def is_transient_error(exc: Exception) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in TRANSIENT_STATUS_CODES
+    return isinstance(exc, httpx.TransportError)
+
+
+async def with_retries(
+    func: Callable[[], Awaitable[Any]],
+    retries: int = 3,
+    backoff: float = 0.5
+) -> Any:
+    """Awaits `func()` and retries it on transient errors.
+
+    The delay between attempts doubles with every retry.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return await func()
+        except httpx.HTTPError as exc:
+            if attempt == retries or not is_transient_error(exc):
+                raise
+            delay = backoff * 2 ** attempt
+            logger.debug(f'Transient error {exc!r}, retry in {delay}s')
+            await asyncio.sleep(delay)
+
+
+async def refresh_access_token(
+    client: httpx.AsyncClient,
+    refresh_token: str,
+    domain: str
+) -> Dict[str, Any]:
+    body = {
+        'app_name': APP_NAME,
+        'app_version': APP_VERSION,
+        'source_token': refresh_token,
+        'requested_token_type': 'access_token',
+        'source_token_type': 'refresh_token'
+    }
+
+    resp = await client.post(
+        f'https://api.amazon.{domain}/auth/token', data=body
+    )
+    resp.raise_for_status()
+    resp_json = resp.json()
+
+    expires_s = int(resp_json['expires_in'])
+    expires = timezone.now() + timezone.timedelta(seconds=expires_s)
+
+    return {'access_token': resp_json['access_token'], 'expires': expires}
+
+
+async def check_device(
+    client: httpx.AsyncClient,
+    limiter: MarketplaceRateLimiter,
+    device: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Validates the credentials of a single device.
+
+    Exchanging the refresh token for a new access token is the cheapest call
+    which fails as soon as Amazon revokes the registration. The new access
+    token is returned so the caller can store it.
+    """
+    result = {
+        'pk': device['pk'],
+        'status': HEALTH_ERROR,
+        'access_token': None,
+        'expires': None,
+        'error': None
+    }
+
+    await limiter.acquire(device['domain'], device['pk'])
+    try:
+        token = await refresh_access_token(
+            client=client,
+            refresh_token=device['refresh_token'],
+            domain=device['domain']
+        )
+    except httpx.HTTPStatusError as exc:
+        status_code = exc.response.status_code
+        # 429 and server errors say nothing about the device itself
+        if status_code < 500 and status_code != 429:
+            result['status'] = HEALTH_INVALID
+        result['error'] = f'HTTP {status_code}'
+    except (httpx.HTTPError, KeyError, ValueError) as exc:
+        result['error'] = repr(exc)
+    else:
+        result['status'] = HEALTH_OK
+        result.update(token)
+
+    logger.debug(f"Device {device['pk']} checked: {result['status']}")
+    return result
+
+
+async def check_devices(
+    devices: Iterable[Dict[str, Any]],
+    concurrency: int = 20,
+    rate: Optional[float] = 10,
+    timeout: float = 10,
+    limiter=None,
+    transport: Optional[httpx.AsyncBaseTransport] = None
+) -> List[Dict[str, Any]]:
+    """Checks many devices concurrently.
+
+    Every device is a dict with `pk`, `domain` and `refresh_token`. At most
+    `concurrency` requests are in flight and at most `rate` requests per
+    second are sent to each marketplace, unless another `limiter` is given.
+    `transport` replaces the network, e.g. with a `httpx.MockTransport`.
+    """
+    limiter = limiter or MarketplaceRateLimiter(rate)
+    limits = httpx.Limits(
+        max_connections=concurrency,
+        max_keepalive_connections=concurrency
+    )
+
+    async with httpx.AsyncClient(
+        timeout=timeout, limits=limits, transport=transport
+    ) as client:
+        return await run_bounded(
+            lambda device: check_device(client, limiter, device),
+            devices,
+            concurrency=concurrency
+        )
+
+
+async def deregister(
+    client: httpx.AsyncClient,
+    access_token: str,
+    domain: str
+) -> Dict[str, Any]:
+    body = {'deregister_all_existing_accounts': False}
+    headers = {'Authorization': f'Bearer {access_token}'}
+
+    resp = await client.post(
+        f'https://api.amazon.{domain}/auth/deregister',
+        json=body,
+        headers=headers
+    )
+    resp.raise_for_status()
+
+    return resp.json()
+
+
+async def deregister_device(
+    client: httpx.AsyncClient,
+    limiter: MarketplaceRateLimiter,
+    device: Dict[str, Any],
+    retries: int = 3
+) -> Dict[str, Any]:
+    """Deregisters a single device on the Amazon side.
+
+    An expired access token is refreshed first, because Amazon only accepts
+    the deregistration with a valid one.
+    """
+    result = {'pk': device['pk'], 'success': False, 'error': None}
+    access_token = device['access_token']
+
+    async def refresh():
+        await limiter.acquire(device['domain'], device['pk'])
+        return await refresh_access_token(
+            client=client,
+            refresh_token=device['refresh_token'],
+            domain=device['domain']
+        )
+
+    async def deregister_():
+        await limiter.acquire(device['domain'], device['pk'])
+        return await deregister(
+            client=client,
+            access_token=access_token,
+            domain=device['domain']
+        )
+
+    try:
+        if device['expires'] <= timezone.now() + timezone.timedelta(minutes=1):
+            token = await with_retries(refresh, retries=retries)
+            access_token = token['access_token']
+        await with_retries(deregister_, retries=retries)
+    except httpx.HTTPStatusError as exc:
+        result['error'] = f'HTTP {exc.response.status_code}'
+    except (httpx.HTTPError, KeyError, ValueError) as exc:
+        result['error'] = repr(exc)
+    else:
+        result['success'] = True
+
+    logger.debug(f"Device {device['pk']} deregistered: {result['success']}")
+    return result
+
+
+async def deregister_devices(
+    devices: Iterable[Dict[str, Any]],
+    concurrency: int = 10,
+    rate: Optional[float] = 10,
+    retries: int = 3,
+    timeout: float = 10,
+    limiter=None,
+    transport: Optional[httpx.AsyncBaseTransport] = None
+) -> List[Dict[str, Any]]:
+    """Deregisters many devices concurrently.
+
+    Every device is a dict with `pk`, `domain`, `access_token`, `expires`
+    and `refresh_token`. Rate limits and `transport` as in
+    :func:`check_devices`.
+    """
+    limiter = limiter or MarketplaceRateLimiter(rate)
+    limits = httpx.Limits(
+        max_connections=concurrency,
+        max_keepalive_connections=concurrency
+    )
+
+    async with httpx.AsyncClient(
+        timeout=timeout, limits=limits, transport=transport
+    ) as client:
+        return await run_bounded(
+            lambda device: deregister_device(client, limiter, device, retries),
+            devices,
+            concurrency=concurrency
+        )
@@ -0,0 +1,234 @@
+"""Envelope encryption of single values.
+
+Values are encrypted with AES-256-GCM under a random data key. The data keys
+are stored wrapped (encrypted) by a key encryption key from the settings, so
+changing that key only rewraps the few data keys, not every value. Unwrapped
+data keys are cached for the life of the process: decrypting a value costs a
+single AES-GCM operation, a few microseconds.
+
+FIELD_ENCRYPTION_KEYS lists urlsafe base64 encoded 32 byte keys, the first
+one wraps new data keys, the others are only used to unwrap. Without the
+setting, which the settings only allow with DEBUG on, a key is derived from
+SECRET_KEY.
+"""
+import base64
+import hashlib
+import os
+import threading
+import time
+from functools import partial
+from typing import Callable, Dict, Optional, Tuple
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+PREFIX = 'enc1$'
+NONCE_SIZE = 12
+
+
+class DecryptionError(Exception):
+    pass
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _derive_from_secret_key() -> bytes:
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b'myaudible field encryption'
+    ).derive(settings.SECRET_KEY.encode())
+
+
+def get_key_encryption_keys() -> Dict[str, bytes]:
+    """Returns the key encryption keys by id, the current one first."""
+    keys = getattr(settings, 'FIELD_ENCRYPTION_KEYS', None) or []
+    try:
+        keys = [_b64decode(key) for key in keys]
+    except ValueError:
+        raise ImproperlyConfigured('FIELD_ENCRYPTION_KEYS must be base64')
+    if any(len(key) != 32 for key in keys):
+        raise ImproperlyConfigured('FIELD_ENCRYPTION_KEYS must be 32 bytes')
+    keys = keys or [_derive_from_secret_key()]
+    return {hashlib.sha256(key).hexdigest()[:8]: key for key in keys}
+
+
+def generate_key_encryption_key() -> str:
+    """Returns a new key for FIELD_ENCRYPTION_KEYS."""
+    return _b64encode(os.urandom(32))
+
+
+def _seal(key: bytes, data: bytes) -> bytes:
+    nonce = os.urandom(NONCE_SIZE)
+    return nonce + AESGCM(key).encrypt(nonce, data, None)
+
+
+def _open(cipher: AESGCM, data: bytes) -> bytes:
+    return cipher.decrypt(data[:NONCE_SIZE], data[NONCE_SIZE:], None)
+
+
+def wrap_data_key(data_key: bytes) -> Tuple[str, bytes]:
+    """Encrypts a data key with the current key encryption key."""
+    kek_id, kek = next(iter(get_key_encryption_keys().items()))
+    return kek_id, _seal(kek, data_key)
+
+
+def unwrap_data_key(kek_id: str, wrapped: bytes) -> bytes:
+    try:
+        kek = get_key_encryption_keys()[kek_id]
+    except KeyError:
+        raise DecryptionError(f'Unknown key encryption key {kek_id}')
+    return _open(AESGCM(kek), bytes(wrapped))
+
+
+def is_encrypted(value) -> bool:
+    return isinstance(value, str) and value.startswith(PREFIX)
+
+
+def encrypt(key_id: int, cipher: AESGCM, plaintext: str) -> str:
+    nonce = os.urandom(NONCE_SIZE)
+    data = nonce + cipher.encrypt(nonce, plaintext.encode(), None)
+    return f'{PREFIX}{key_id}${_b64encode(data)}'
+
+
+def get_key_id(token: str) -> int:
+    try:
+        return int(token[len(PREFIX):].split('$', 1)[0])
+    except ValueError:
+        raise DecryptionError('Malformed encrypted value')
+
+
+def decrypt(cipher: AESGCM, token: str) -> str:
+    data = _b64decode(token[len(PREFIX):].split('$', 1)[1])
+    return _open(cipher, data).decode()
+
+
+class DataKeyCache:
+    """Unwrapped data keys of this process.
+
+    `load(key_id)` returns ``(kek_id, wrapped key)`` of a stored data key,
+    `latest(kek_ids)` the ``(key_id, kek_id, wrapped key, created)`` of the
+    newest data key wrapped by one of the given ids or None and
+    `store(kek_id, wrapped)` saves a new data key and returns its id.
+
+    `store` may run in the transaction of the caller. With `on_commit`
+    (e.g. ``transaction.on_commit``) a new key is only used by other
+    threads once that transaction committed. `is_pending(callback)` tells
+    whether a callback passed to `on_commit` still waits for its
+    transaction; a key whose callback was discarded by a rollback is
+    dropped without asking the database.
+    """
+
+    def __init__(
+        self,
+        load: Callable,
+        latest: Callable,
+        store: Callable,
+        max_age: Optional[float] = None,
+        on_commit: Optional[Callable] = None,
+        is_pending: Optional[Callable] = None
+    ) -> None:
+        self._load = load
+        self._latest = latest
+        self._store = store
+        self.max_age = max_age
+        self._on_commit = on_commit
+        self._is_pending = is_pending
+        self._ciphers: Dict[int, AESGCM] = {}
+        self._active: Optional[Tuple[int, float]] = None
+        # new keys of this thread whose transaction did not commit yet
+        self._local = threading.local()
+        # on_commit() runs the callback at once outside of transactions
+        self._lock = threading.RLock()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._ciphers.clear()
+            self._active = None
+            self._local = threading.local()
+
+    def get(self, key_id: int) -> AESGCM:
+        cipher = self._ciphers.get(key_id)
+        if cipher is None:
+            kek_id, wrapped = self._load(key_id)
+            cipher = AESGCM(unwrap_data_key(kek_id, wrapped))
+            self._ciphers[key_id] = cipher
+        return cipher
+
+    def active(self) -> Tuple[int, AESGCM]:
+        """Returns the data key for new values, creates one if needed."""
+        with self._lock:
+            key = self._active
+            if key is None or self._is_expired(key[1]):
+                key = self._get_pending() or self._get_or_create()
+        return key[0], self.get(key[0])
+
+    def _is_expired(self, created: float) -> bool:
+        return bool(self.max_age) and time.time() - created > self.max_age
+
+    def _get_pending(self) -> Optional[Tuple[int, float]]:
+        pending = getattr(self._local, 'pending', None)
+        if pending is None:
+            return None
+        key, callback = pending
+        if self._is_pending is not None and not self._is_pending(callback):
+            # the transaction which stored it was rolled back
+            self._local.pending = None
+            self._ciphers.pop(key[0], None)
+            return None
+        if self._is_expired(key[1]):
+            return None
+        return key
+
+    def _activate(self, key: Tuple[int, float]) -> None:
+        with self._lock:
+            self._active = key
+            pending = getattr(self._local, 'pending', None)
+            if pending is not None and pending[0] == key:
+                self._local.pending = None
+
+    def _get_or_create(self) -> Tuple[int, float]:
+        current_kek_id = next(iter(get_key_encryption_keys()))
+        latest = self._latest([current_kek_id])
+        if latest is not None:
+            key_id, kek_id, wrapped, created = latest
+            if not self._is_expired(created):
+                self._ciphers[key_id] = AESGCM(unwrap_data_key(kek_id, wrapped))
+                self._active = key_id, created
+                return self._active
+
+        data_key = AESGCM.generate_key(bit_length=256)
+        kek_id, wrapped = wrap_data_key(data_key)
+        key_id = self._store(kek_id, wrapped)
+        self._ciphers[key_id] = AESGCM(data_key)
+        key = key_id, time.time()
+        if self._on_commit is None:
+            self._active = key
+        else:
+            callback = partial(self._activate, key)
+            self._local.pending = key, callback
+            self._on_commit(callback)
+        return key
+
+    def encrypt(self, plaintext: str) -> str:
+        key_id, cipher = self.active()
+        return encrypt(key_id, cipher, plaintext)
+
+    def decrypt(self, token: str) -> str:
+        try:
+            return decrypt(self.get(get_key_id(token)), token)
+        except DecryptionError:
+            raise
+        except Exception as exc:
+            raise DecryptionError(f'Value could not be decrypted: {exc!r}')
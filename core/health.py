@@ -0,0 +1,13 @@
+"""Health states of stored devices, set by the credential checks."""
+
+HEALTH_UNKNOWN = 'unknown'
+HEALTH_OK = 'ok'
+HEALTH_INVALID = 'invalid'
+HEALTH_ERROR = 'error'
+
+HEALTH_CHOICES = [
+    (HEALTH_UNKNOWN, 'Not checked'),
+    (HEALTH_OK, 'Valid'),
+    (HEALTH_INVALID, 'Invalid'),
+    (HEALTH_ERROR, 'Check failed'),
+]
@@ -1,17 +1,43 @@
 import base64
+import functools
 import json
 import re
 import secrets
+import time
 import uuid
 from collections import UserDict
-from urllib.parse import parse_qs
+from html.parser import HTMLParser
+from importlib import import_module
+from urllib.parse import parse_qs, quote_plus, urlencode
 
-import httpx
+from django.conf import settings
 from django.utils import timezone
-from typing import Dict, Optional, Tuple
+from django.utils.module_loading import import_string
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
 
+from . import metrics
 from .marketplaces import Marketplace
 
+# httpx is imported on first use, most processes never start a login
+if TYPE_CHECKING:
+    import httpx
+
+
+# form fields of the sign-in pages a headless login can fill, with the
+# names of the answers given by the client
+SIGNIN_FIELDS = {
+    'email': 'email',
+    'password': 'password',
+    'otpCode': 'otp_code',
+    'guess': 'captcha',
+}
+# answers which are only submitted once, a page asking again gets a new one
+SINGLE_USE_ANSWERS = ('otp_code', 'captcha')
+
+# keys of headless logins in the session pool, they belong to API tokens
+# instead of Django sessions
+HEADLESS_SESSION_PREFIX = 'headless:'
+
 
 USER_AGENT = (
     'Mozilla/5.0 (iPhone; CPU iPhone OS 15_0 like Mac OS X) '
@@ -19,6 +45,18 @@ USER_AGENT = (
 )
 
 
+LOGIN_STAGE_SECONDS = metrics.histogram(
+    'myaudible_login_stage_seconds',
+    'Time spent per stage of a device login.',
+    ['stage', 'marketplace']
+)
+LOGIN_UPSTREAM_RESPONSES = metrics.counter(
+    'myaudible_login_upstream_responses_total',
+    'Responses received from Amazon during device logins.',
+    ['marketplace', 'status_code']
+)
+
+
 def build_device_serial() -> str:
     return uuid.uuid4().hex.upper()
 
@@ -51,33 +89,30 @@ def build_init_cookies() -> Dict[str, str]:
     return {'frc': frc, 'map-md': map_md, 'amzn-app-id': amzn_app_id}
 
 
-def build_oauth_url(
+@functools.lru_cache(maxsize=None)
+def _build_oauth_url_template(
     country_code: str,
     domain: str,
     market_place_id: str,
-    client_id: str,
-    with_username: bool = False
+    with_username: bool
 ) -> Tuple[str, str]:
-    """Builds the url to login to Amazon as an Audible device"""
+    """Returns the login url split at the position of the client id.
 
+    Everything except the client id is static per marketplace, so the
+    parts are built once and cached.
+    """
     base_url = f'https://www.amazon.{domain}/ap/signin'
     return_to = f'https://www.amazon.{domain}/ap/maplanding'
     assoc_handle = f'amzn_audible_ios_{country_code}'
     page_id = 'amzn_audible_ios'
 
     if with_username:
-        if country_code.lower() not in ('de', 'us', 'uk'):
-            raise ValueError(
-                'Login with username is only supported for DE, US '
-                'and UK marketplaces!'
-            )
-
         base_url = f'https://www.audible.{domain}/ap/signin'
         return_to = f'https://www.audible.{domain}/ap/maplanding'
         assoc_handle = f'amzn_audible_ios_lap_{country_code}'
         page_id = 'amzn_audible_ios_privatepool'
 
-    oauth_params = {
+    params_before = {
         'openid.oa2.response_type': 'token',
         'openid.return_to': return_to,
         'openid.assoc_handle': assoc_handle,
@@ -91,7 +126,8 @@ def build_oauth_url(
         ),
         'openid.mode': 'checkid_setup',
         'openid.ns.oa2': 'http://www.amazon.com/ap/ext/oauth/2',
-        'openid.oa2.client_id': f'device:{client_id}',
+    }
+    params_after = {
         'openid.ns.pape': 'http://specs.openid.net/extensions/pape/1.0',
         'marketPlaceId': market_place_id,
         'openid.oa2.scope': 'device_auth_access',
@@ -100,7 +136,121 @@ def build_oauth_url(
         'openid.pape.max_auth_age': '0'
     }
 
-    return httpx.URL(base_url, params=oauth_params)
+    prefix = f'{base_url}?{urlencode(params_before)}&openid.oa2.client_id='
+    suffix = f'&{urlencode(params_after)}'
+    return prefix, suffix
+
+
+def build_oauth_url(
+    country_code: str,
+    domain: str,
+    market_place_id: str,
+    client_id: str,
+    with_username: bool = False
+) -> 'httpx.URL':
+    """Builds the url to login to Amazon as an Audible device"""
+    import httpx
+
+    if with_username and country_code.lower() not in ('de', 'us', 'uk'):
+        raise ValueError(
+            'Login with username is only supported for DE, US '
+            'and UK marketplaces!'
+        )
+
+    prefix, suffix = _build_oauth_url_template(
+        country_code, domain, market_place_id, with_username
+    )
+    return httpx.URL(prefix + quote_plus(f'device:{client_id}') + suffix)
+
+
+class FormParser(HTMLParser):
+    """Collects the forms of a page with their action and input values.
+
+    The text of the sign-in error box and the captcha image are collected
+    as well.
+    """
+    VOID_TAGS = ('area', 'br', 'hr', 'img', 'input', 'link', 'meta')
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.forms: List[Dict] = []
+        self.error_parts: List[str] = []
+        self.captcha_url: Optional[str] = None
+        self._error_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if self._error_depth and tag not in self.VOID_TAGS:
+            self._error_depth += 1
+        elif attrs.get('id') == 'auth-error-message-box':
+            self._error_depth = 1
+
+        if tag == 'form':
+            self.forms.append({
+                'attrs': attrs,
+                'action': attrs.get('action') or '',
+                'method': (attrs.get('method') or 'get').upper(),
+                'fields': {},
+            })
+        elif tag in ('input', 'textarea', 'select') and self.forms:
+            name = attrs.get('name')
+            if name and attrs.get('type') not in ('submit', 'button', 'image'):
+                self.forms[-1]['fields'][name] = attrs.get('value') or ''
+        elif tag == 'img' and attrs.get('id') == 'auth-captcha-image':
+            self.captcha_url = attrs.get('src')
+
+    def handle_endtag(self, tag):
+        if self._error_depth and tag not in self.VOID_TAGS:
+            self._error_depth -= 1
+
+    def handle_data(self, data):
+        if self._error_depth and data.strip():
+            self.error_parts.append(data.strip())
+
+    @property
+    def error(self) -> Optional[str]:
+        return ' '.join(self.error_parts) or None
+
+
+def parse_forms(content: str) -> List[Dict]:
+    parser = FormParser()
+    parser.feed(content)
+    return parser.forms
+
+
+class LoginChallenge(Exception):
+    """A sign-in page asks for answers which are not known (yet).
+
+    `fields` are the names of the missing answers (see SIGNIN_FIELDS),
+    `message` is the error shown on the page.
+    """
+
+    def __init__(
+        self,
+        fields: List[str],
+        message: Optional[str] = None,
+        captcha_url: Optional[str] = None
+    ) -> None:
+        super().__init__(message or f"Missing {', '.join(fields)}")
+        self.fields = fields
+        self.message = message
+        self.captcha_url = captcha_url
+
+
+class LoginError(Exception):
+    pass
+
+
+def get_login_transport() -> Optional['httpx.BaseTransport']:
+    """Returns the transport for the requests to Amazon.
+
+    AUDIBLE_LOGIN_TRANSPORT can name a factory (e.g.
+    ``core.standin.standin_transport``) to run logins without Amazon.
+    """
+    factory = getattr(settings, 'AUDIBLE_LOGIN_TRANSPORT', None)
+    if factory is None:
+        return None
+    return import_string(factory)()
 
 
 class DjangoAudibleLogin:
@@ -108,17 +258,23 @@ class DjangoAudibleLogin:
         self,
         country_code: str,
         serial: Optional[str] = None,
-        with_username: bool = False
+        with_username: bool = False,
+        transport: Optional['httpx.BaseTransport'] = None
     ) -> None:
         self._with_username = with_username
+        self._transport = transport or get_login_transport()
         self._marketplace = Marketplace.from_country_code(country_code)
         self._serial = serial or build_device_serial()
-        self._session: Optional[httpx.AsyncClient] = None
-        self._start_url: httpx.URL = self.build_start_url()
+        self._session: Optional['httpx.Client'] = None
+        self._start_url: 'httpx.URL' = self.build_start_url()
         self._access_token: Optional[str] = None
-        self._last_request: Optional[httpx.Request] = None
-        self._last_response: Optional[httpx.Response] = None
+        self._last_request: Optional['httpx.Request'] = None
+        self._last_response: Optional['httpx.Response'] = None
+        self._last_response_content = None
         self._proxy_abs_url = None
+        # answers of a headless login by SIGNIN_FIELDS names
+        self._answers: Dict[str, str] = {}
+        self._submitted = set()
 
     def build_start_url(self):
         return build_oauth_url(
@@ -130,6 +286,8 @@ class DjangoAudibleLogin:
         )
 
     def create_session(self):
+        import httpx
+
         default_headers = {
             'User-Agent': USER_AGENT,
             'Accept-Language': 'en-US',
@@ -140,25 +298,116 @@ class DjangoAudibleLogin:
         self._session = httpx.Client(
             headers=default_headers,
             cookies=init_cookies,
-            base_url= base_url
+            base_url= base_url,
+            transport=self._transport
         )
 
     def request(self, method, url, **kwargs):
-        response = self._session.request(method, url, **kwargs)
+        marketplace = self._marketplace.country_code
+        with LOGIN_STAGE_SECONDS.time(
+                stage='upstream_fetch', marketplace=marketplace):
+            response = self._session.request(method, url, **kwargs)
+        LOGIN_UPSTREAM_RESPONSES.inc(
+            marketplace=marketplace, status_code=response.status_code
+        )
 
         self._last_response = response
         self._last_request = response.request
         self._last_response_content = self._last_response.content
 
-        if 'text/html' in response.headers['Content-Type']:
-            self._last_response_content = self.rewrite_html()
+        # pages of a headless login are not shown, nothing to rewrite
+        if (
+            self._proxy_abs_url is not None
+            and 'text/html' in response.headers['Content-Type']
+        ):
+            with LOGIN_STAGE_SECONDS.time(
+                    stage='rewrite_html', marketplace=marketplace):
+                self._last_response_content = self.rewrite_html()
         
         if b'openid.oa2.access_token' in self._last_request.url.query:
             parsed_url = parse_qs(self._last_request.url.query.decode())
             access_token = parsed_url['openid.oa2.access_token'][0]
             self._access_token = access_token
 
+    def login(self, max_steps: int = 8, **answers) -> None:
+        """Fills and submits the sign-in forms without a browser.
+
+        `answers` are the values for the form fields by the names of
+        SIGNIN_FIELDS (email, password, otp_code, captcha). They are kept
+        for later calls, but a two-step code or captcha is submitted only
+        once and the password only again on a page with a captcha.
+        Returns when the access token was received, raises LoginChallenge
+        if the current page needs an answer which is not known and
+        LoginError for pages which can not be filled.
+        """
+        for name, value in answers.items():
+            if value:
+                self._answers[name] = value
+                self._submitted.discard(name)
+
+        for _ in range(max_steps):
+            if self._access_token is not None:
+                return
+            self.submit_signin_form()
+        raise LoginError(f'Not logged in after {max_steps} pages')
+
+    def submit_signin_form(self) -> None:
+        response = self._last_response
+        parser = FormParser()
+        parser.feed(response.text)
+        form = next(
+            (f for f in parser.forms if SIGNIN_FIELDS.keys() & f['fields']),
+            None
+        )
+        if form is None:
+            raise LoginError(
+                parser.error
+                or f'Unsupported sign-in page: HTTP {response.status_code}'
+            )
+
+        needed = [name for name in SIGNIN_FIELDS if name in form['fields']]
+        answers = dict(self._answers)
+        # a submitted password is asked again if it was wrong or together
+        # with a captcha, only the latter is answered with it again
+        if 'password' in self._submitted and 'guess' not in needed:
+            answers.pop('password', None)
+
+        data = dict(form['fields'])
+        missing = []
+        for name in needed:
+            value = answers.get(SIGNIN_FIELDS[name])
+            if value:
+                data[name] = value
+            elif not data[name]:
+                # e.g. the email of a repeated password page is prefilled
+                missing.append(SIGNIN_FIELDS[name])
+        if missing:
+            captcha_url = parser.captcha_url
+            if captcha_url:
+                captcha_url = str(response.url.join(captcha_url))
+            raise LoginChallenge(missing, parser.error, captcha_url)
+
+        for name in needed:
+            answer = SIGNIN_FIELDS[name]
+            self._submitted.add(answer)
+            if answer in SINGLE_USE_ANSWERS:
+                self._answers.pop(answer, None)
+        url = response.url.join(form['action']) if form['action'] else response.url
+        self.request(form['method'], url, data=data)
+
+    def memory_usage(self) -> int:
+        """Returns the approximate bytes held by the last response."""
+        size = 0
+        if self._last_response is not None:
+            size += len(self._last_response.content)
+            # the rewritten page is kept as str besides the raw bytes
+            if self._last_response_content is not self._last_response.content:
+                size += len(self._last_response_content)
+        return size
+
     def rewrite_html(self):
+        import httpx
+
         base_url = self._start_url.scheme + '://' + self._start_url.host
         reserve_byte = httpx.URL(self._proxy_abs_url).raw_path.decode()
         abs_uri2 = self._proxy_abs_url
@@ -227,9 +476,17 @@ class DjangoAudibleLogin:
             'auth_data': {'access_token': self._access_token}
         }
     
-        resp = httpx.post(
-            f'https://api.amazon.{self._marketplace.domain}/auth/register',
-            json=body
+        import httpx
+
+        marketplace = self._marketplace.country_code
+        with LOGIN_STAGE_SECONDS.time(stage='register', marketplace=marketplace):
+            with httpx.Client(transport=self._transport) as client:
+                resp = client.post(
+                    f'https://api.amazon.{self._marketplace.domain}/auth/register',
+                    json=body
+                )
+        LOGIN_UPSTREAM_RESPONSES.inc(
+            marketplace=marketplace, status_code=resp.status_code
         )
 
         resp_json = resp.json()
@@ -294,12 +551,14 @@ class SessionObject:
 
     @property
     def is_expired(self):
-        return self._expires_at >= timezone.now()
+        return self._expires_at <= timezone.now()
 
     def close_session(self):
-        self.session._session.close()
+        if self.session._session is not None:
+            self.session._session.close()
 
-    def start_session(self, proxy_url):
+    def start_session(self, proxy_url=None):
+        """Opens the sign-in page, without `proxy_url` for a headless login."""
         self.session.create_session()
         self.session._proxy_abs_url = proxy_url
         self.session.request('GET', self.session._start_url)
@@ -309,7 +568,26 @@ class SessionObject:
         return self.session._access_token is not None
 
 
+def get_existing_session_keys(session_keys):
+    """Returns the keys of `session_keys` which belong to live Django sessions."""
+    engine = import_module(settings.SESSION_ENGINE)
+    store = engine.SessionStore
+    if hasattr(store, 'get_model_class'):
+        # database backed sessions, one query per batch
+        return set(
+            store.get_model_class().objects.filter(
+                session_key__in=session_keys,
+                expire_date__gt=timezone.now()
+            ).values_list('session_key', flat=True)
+        )
+    return {key for key in session_keys if store().exists(key)}
+
+
 class AudibleLoginSessionPool(UserDict):
+    # seconds between two reconciliations with the Django sessions
+    reconcile_interval = 60
+    _last_reconcile = 0.0
+
     def create_session(self, session_key, expires_in=300, **kwargs):
         if session_key in self:
             raise Exception('Login session exists')
@@ -349,9 +627,48 @@ class AudibleLoginSessionPool(UserDict):
 
     def cleanup_sessions(self):
         for session_id in list(self.keys()):
-            if self[session_id].is_expired:
+            s_obj = self.get(session_id)
+            if s_obj is not None and s_obj.is_expired:
                 self.remove_session(session_id)
 
+    def reconcile(self, batch_size=500):
+        """Removes expired login sessions and those of deleted Django sessions.
+
+        This replaces a delete signal on the sessions, which would stop
+        Django from deleting expired sessions in bulk.
+        """
+        self._last_reconcile = time.monotonic()
+        self.cleanup_sessions()
+        # headless logins only expire
+        session_keys = [
+            key for key in self.keys()
+            if not key.startswith(HEADLESS_SESSION_PREFIX)
+        ]
+        for start in range(0, len(session_keys), batch_size):
+            batch = session_keys[start:start + batch_size]
+            existing = get_existing_session_keys(batch)
+            for session_key in batch:
+                if session_key not in existing:
+                    self.remove_session(session_key)
+
+    def maybe_reconcile(self):
+        """Reconciles at most once per `reconcile_interval`."""
+        if time.monotonic() - self._last_reconcile >= self.reconcile_interval:
+            self.reconcile()
+
 
 session_pool = AudibleLoginSessionPool()
 
+metrics.gauge(
+    'myaudible_login_sessions',
+    'Live device login sessions in this process.',
+    function=lambda: len(session_pool)
+)
+metrics.gauge(
+    'myaudible_login_sessions_memory_bytes',
+    'Approximate memory held by the live login sessions in this process.',
+    function=lambda: sum(
+        s_obj.session.memory_usage() for s_obj in list(session_pool.values())
+    )
+)
+
@@ -1,5 +1,6 @@
 import logging
-from typing import Dict, Optional
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional
 
 
 logger = logging.getLogger(__name__)
@@ -59,40 +60,16 @@ MARKETPLACES_TEMPLATES = {
 }
 
 
-def get_marketplaces_choices():
-    mlist = []
-    for country_code in MARKETPLACES_TEMPLATES:
-        country = MARKETPLACES_TEMPLATES[country_code]['country']
-        mlist.append([country_code, country])
-    sorted_mlist = sorted(mlist, key=lambda x: x[0])
-    return sorted_mlist
-
-
-def search_template(key: str, value: str) -> Optional[Dict[str, str]]:
-    for country_code in MARKETPLACES_TEMPLATES:
-        market = MARKETPLACES_TEMPLATES[country_code]
-        market['country_code'] = country_code
-
-        if key not in market:
-            msg = f"{key} is not a valid key to search for."
-            logger.error(msg)
-            raise Exception(msg)
-
-        if market[key] == value:
-            logger.debug(f"Found marketplace for {country_code}")
-            return market
-
-    msg = f"Can't find {value} in {key}"
-    logger.info(msg)
-    raise Exception(msg)
-
-
 class Marketplace:
     """
     Instance for an Audible marketplace
-    
+
+    Instances are immutable and shared. Use :meth:`from_country_code` or
+    :func:`get_marketplace` instead of creating new ones.
     """
 
+    __slots__ = ('country_code', 'domain', 'market_place_id', 'country')
+
     def __init__(
             self,
             country_code: str,
@@ -100,10 +77,13 @@ class Marketplace:
             market_place_id: str,
             country: str
     ) -> None:
-        self.country_code = country_code
-        self.domain = domain
-        self.market_place_id = market_place_id
-        self.country = country
+        object.__setattr__(self, 'country_code', country_code)
+        object.__setattr__(self, 'domain', domain)
+        object.__setattr__(self, 'market_place_id', market_place_id)
+        object.__setattr__(self, 'country', country)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
 
     def __repr__(self):
         return (
@@ -120,7 +100,58 @@ class Marketplace:
 
     @classmethod
     def from_country_code(cls, country_code: str) -> "Marketplace":
-        market = search_template(key='country_code', value=country_code)
-        market = cls(**market)
+        market = get_marketplace(key='country_code', value=country_code)
+        if market is None:
+            msg = f"Can't find {country_code} in country_code"
+            logger.info(msg)
+            raise Exception(msg)
         return market
- 
+
+
+def _build_indexes() -> Mapping[str, Mapping[str, Marketplace]]:
+    markets = [
+        Marketplace(country_code=country_code, **template)
+        for country_code, template in MARKETPLACES_TEMPLATES.items()
+    ]
+    return MappingProxyType({
+        key: MappingProxyType({getattr(m, key): m for m in markets})
+        for key in Marketplace.__slots__
+    })
+
+
+# the registry is built once, lookups are a dict access
+MARKETPLACES_TEMPLATES = MappingProxyType({
+    country_code: MappingProxyType(template)
+    for country_code, template in MARKETPLACES_TEMPLATES.items()
+})
+MARKETPLACES = _build_indexes()
+MARKETPLACES_CHOICES = tuple(sorted(
+    (m.country_code, m.country) for m in MARKETPLACES['country_code'].values()
+))
+
+
+def get_marketplaces_choices():
+    return [list(choice) for choice in MARKETPLACES_CHOICES]
+
+
+def get_marketplace(key: str, value: str) -> Optional[Marketplace]:
+    """Returns the marketplace whose `key` equals `value` or ``None``."""
+    try:
+        index = MARKETPLACES[key]
+    except KeyError:
+        msg = f"{key} is not a valid key to search for."
+        logger.error(msg)
+        raise Exception(msg)
+
+    return index.get(value)
+
+
+def search_template(key: str, value: str) -> Optional[Dict[str, str]]:
+    market = get_marketplace(key=key, value=value)
+    if market is None:
+        msg = f"Can't find {value} in {key}"
+        logger.info(msg)
+        raise Exception(msg)
+
+    logger.debug(f"Found marketplace for {market.country_code}")
+    return market.to_dict()
@@ -0,0 +1,173 @@
+import logging
+import random
+
+from django.conf import settings
+
+from . import profiling, routers
+from .queries import record_queries
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_QUERY_PROFILER = {
+    # share of requests which are profiled, 0 disables the profiler
+    'SAMPLE_RATE': 0.0,
+    # a request is logged if it exceeds one of these limits
+    'MAX_QUERIES': 20,
+    'MAX_TIME': 0.5,
+    'MAX_REPEATS': 5,
+    # number of repeated statements written to the log
+    'TOP_STATEMENTS': 3,
+}
+
+
+def get_query_profiler_settings():
+    return {
+        **DEFAULT_QUERY_PROFILER,
+        **getattr(settings, 'QUERY_PROFILER', {})
+    }
+
+
+class QueryProfilerMiddleware:
+    """Logs requests with too many, slow or repeated SQL queries.
+
+    Only a sample of the requests is profiled, see QUERY_PROFILER in the
+    settings.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        config = get_query_profiler_settings()
+        sample_rate = config['SAMPLE_RATE']
+        if not sample_rate or random.random() >= sample_rate:
+            return self.get_response(request)
+
+        with record_queries() as recorder:
+            response = self.get_response(request)
+
+        repeated = recorder.repeated_statements(config['MAX_REPEATS'])
+        if (
+            recorder.count > config['MAX_QUERIES']
+            or recorder.total_time > config['MAX_TIME']
+            or repeated
+        ):
+            match = request.resolver_match
+            view_name = match.view_name if match else request.path
+            top = recorder.repeated_statements()[:config['TOP_STATEMENTS']]
+            logger.warning(
+                '%s: %s queries in %.1f ms, repeated statements:%s',
+                view_name,
+                recorder.count,
+                recorder.total_time * 1000,
+                ''.join(f'\n  {count}x {sql}' for sql, count in top) or ' none',
+                extra={
+                    'view_name': view_name,
+                    'query_count': recorder.count,
+                    'query_time': recorder.total_time,
+                }
+            )
+
+        return response
+
+
+DEFAULT_CPU_PROFILER = {
+    # share of the requests to the VIEWS which are profiled, 0 disables it
+    'SAMPLE_RATE': 0.0,
+    # view names (see resolver_match.view_name), empty profiles all views
+    'VIEWS': [],
+    'DIRECTORY': 'profiles',
+    # 'collapsed' stacks of a sampler thread or cProfile 'pstats'
+    'FORMAT': profiling.FORMAT_COLLAPSED,
+    # seconds between two stack samples in 'collapsed' format
+    'INTERVAL': 0.005,
+}
+
+
+def get_cpu_profiler_settings():
+    return {
+        **DEFAULT_CPU_PROFILER,
+        **getattr(settings, 'CPU_PROFILER', {})
+    }
+
+
+class CPUProfilerMiddleware:
+    """Profiles a sample of the requests and writes one file per request.
+
+    Use ``manage.py profile_report`` to aggregate the profiles, see
+    CPU_PROFILER in the settings.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        profiler = getattr(request, '_cpu_profiler', None)
+        if profiler is not None:
+            path = profiler.stop(request.resolver_match.view_name)
+            logger.debug('Profile written to %s', path)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        config = get_cpu_profiler_settings()
+        sample_rate = config['SAMPLE_RATE']
+        if not sample_rate or random.random() >= sample_rate:
+            return None
+
+        views = config['VIEWS']
+        if views and request.resolver_match.view_name not in views:
+            return None
+
+        request._cpu_profiler = profiling.RequestProfiler(
+            config['DIRECTORY'], config['FORMAT'], config['INTERVAL']
+        )
+        request._cpu_profiler.start()
+        return None
+
+
+class ReplicaMiddleware:
+    """Runs the read-only views in REPLICA_VIEWS against the replica.
+
+    After a request with an unsafe method the user is pinned to the
+    primary for REPLICA_PIN_SECONDS, see `routers.pin_users()`, so they
+    read their own writes.
+    """
+
+    safe_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            response = self.get_response(request)
+        finally:
+            token = getattr(request, '_replica_token', None)
+            if token is not None:
+                routers._use_replica.reset(token)
+
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated and (
+            request.method not in self.safe_methods
+            or getattr(request, '_pin_to_primary', False)
+        ):
+            routers.pin_users([user.pk])
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        user = getattr(request, 'user', None)
+        if (
+            routers.get_replica_alias()
+            and request.method in self.safe_methods
+            and request.resolver_match.view_name
+                in getattr(settings, 'REPLICA_VIEWS', ())
+            # token authenticated views check the pin themselves
+            and not (user is not None and user.is_authenticated
+                     and routers.is_pinned(user.pk))
+        ):
+            request._replica_token = routers._use_replica.set(True)
+        return None
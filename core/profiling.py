@@ -0,0 +1,116 @@
+import cProfile
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+
+FORMAT_COLLAPSED = 'collapsed'
+FORMAT_PSTATS = 'pstats'
+
+EXTENSIONS = {FORMAT_COLLAPSED: '.folded', FORMAT_PSTATS: '.prof'}
+
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get('__name__', '?')
+    return f'{module}.{getattr(code, "co_qualname", code.co_name)}'
+
+
+class StackSampler(threading.Thread):
+    """Samples the call stack of a thread in a fixed interval.
+
+    The stacks are counted in the collapsed format of flamegraph.pl, only
+    the profiled thread pays for the sampling while it holds the GIL.
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005) -> None:
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self) -> Counter:
+        self._stopped.set()
+        self.join()
+        return self.stacks
+
+
+class RequestProfiler:
+    """Profiles the current thread and writes the result to `directory`."""
+
+    def __init__(
+        self,
+        directory: str,
+        output_format: str = FORMAT_COLLAPSED,
+        interval: float = 0.005
+    ) -> None:
+        if output_format not in EXTENSIONS:
+            raise ValueError(f'Unknown profile format {output_format}')
+        self.directory = directory
+        self.output_format = output_format
+        self.interval = interval
+        self._profiler: Optional[cProfile.Profile] = None
+        self._sampler: Optional[StackSampler] = None
+
+    def start(self) -> None:
+        if self.output_format == FORMAT_PSTATS:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            self._sampler = StackSampler(threading.get_ident(), self.interval)
+            self._sampler.start()
+
+    def stop(self, name: str) -> str:
+        """Stops profiling and returns the path of the written profile."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(
+            self.directory,
+            f'{safe_name(name)}.{time.time_ns()}.{os.getpid()}'
+            f'{EXTENSIONS[self.output_format]}'
+        )
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler.dump_stats(path)
+        else:
+            stacks = self._sampler.stop()
+            write_collapsed(stacks, path)
+        return path
+
+
+def safe_name(name: str) -> str:
+    return re.sub(r'[^\w-]', '_', name)
+
+
+def view_name_from_path(path: str) -> str:
+    return os.path.basename(path).split('.', 1)[0]
+
+
+def write_collapsed(stacks: Dict[str, int], path: str) -> None:
+    with open(path, 'w') as f:
+        for stack, count in stacks.items():
+            f.write(f'{stack} {count}\n')
+
+
+def read_collapsed(path: str) -> Counter:
+    stacks = Counter()
+    with open(path) as f:
+        for line in f:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack:
+                stacks[stack] += int(count)
+    return stacks
@@ -0,0 +1,71 @@
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from typing import Dict, List, Tuple
+
+from django.db import connections
+
+
+_IN_LIST = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+
+
+def statement_shape(sql: str) -> str:
+    """Replaces literals and parameter lists so similar queries compare equal."""
+    sql = _STRING.sub('%s', sql)
+    sql = _NUMBER.sub('%s', sql)
+    return _IN_LIST.sub('(%s, ...)', sql)
+
+
+class QueryRecorder:
+    """Records the statements and their duration as database execute wrapper.
+
+    See https://docs.djangoproject.com/en/3.2/topics/db/instrumentation/
+    """
+
+    def __init__(self) -> None:
+        self.queries: List[Dict] = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'sql': sql,
+                'time': time.perf_counter() - start,
+                'alias': context['connection'].alias
+            })
+
+    @property
+    def count(self) -> int:
+        return len(self.queries)
+
+    @property
+    def total_time(self) -> float:
+        return sum(query['time'] for query in self.queries)
+
+    def repeated_statements(self, threshold: int = 2) -> List[Tuple[str, int]]:
+        """Returns the shapes executed at least `threshold` times.
+
+        Many executions of the same shape are the typical sign of an N+1
+        query pattern.
+        """
+        shapes = Counter(statement_shape(q['sql']) for q in self.queries)
+        return [
+            (shape, count) for shape, count in shapes.most_common()
+            if count >= threshold
+        ]
+
+
+@contextmanager
+def record_queries(using=None):
+    """Records the queries of all (or the given) database connections."""
+    recorder = QueryRecorder()
+    aliases = [using] if using else list(connections)
+    with ExitStack() as stack:
+        for alias in aliases:
+            stack.enter_context(connections[alias].execute_wrapper(recorder))
+        yield recorder
@@ -0,0 +1,99 @@
+"""Routes the reads of read-only views to a replica database.
+
+Reads only go to the replica inside `use_replica()`, which
+`core.middleware.ReplicaMiddleware` enters for the views in
+REPLICA_VIEWS. Everything else, including all writes, uses the primary.
+
+Users whose data changed are pinned to the primary for
+REPLICA_PIN_SECONDS, so they read their own writes. The pins are kept in
+the default cache and reach all workers sharing it.
+"""
+import contextvars
+from contextlib import contextmanager
+from typing import Iterable
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+
+# only these apps are read from the replica, sessions and users always
+# come from the primary so a fresh login is never lost to replication lag
+REPLICA_APPS = ('devices',)
+
+_use_replica = contextvars.ContextVar('use_replica', default=False)
+
+
+def get_replica_alias():
+    """Returns the alias of the replica or None if there is none."""
+    alias = getattr(settings, 'REPLICA_DATABASE', None)
+    return alias if alias in settings.DATABASES else None
+
+
+@contextmanager
+def use_replica(enabled=True):
+    token = _use_replica.set(enabled)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def use_primary():
+    """Sends the reads of the block to the primary, e.g. for views which
+    learn the user only after `ReplicaMiddleware` chose the replica."""
+    return use_replica(False)
+
+
+def reads_from_replica() -> bool:
+    """Returns whether the current reads of the replica apps are routed
+    to the replica, whose data may lag behind the primary."""
+    return _use_replica.get() and get_replica_alias() is not None
+
+
+def _pin_key(user_id: int) -> str:
+    return f'replica-pin:{user_id}'
+
+
+def pin_users(user_ids: Iterable[int]) -> None:
+    """Sends the reads of these users to the primary for a while."""
+    if get_replica_alias() is None:
+        return
+    cache.set_many(
+        {_pin_key(pk): True for pk in set(user_ids)},
+        getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+    )
+
+
+def is_pinned(user_id: int) -> bool:
+    return bool(cache.get(_pin_key(user_id)))
+
+
+def pin_to_primary(request):
+    """Sends the following reads of the user to the primary for a while.
+
+    Requests with unsafe methods and changes of the user's devices pin
+    automatically, views which write on GET (e.g. the end of a device
+    login) have to call this.
+    """
+    request._pin_to_primary = True
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and model._meta.app_label in REPLICA_APPS:
+            return get_replica_alias()
+        return None
+
+    def db_for_write(self, model, **hints):
+        # never fall back to the database an instance was read from
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replica gets its schema through replication
+        if db == get_replica_alias():
+            return False
+        return None
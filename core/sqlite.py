@@ -0,0 +1,65 @@
+"""Connection settings for running on SQLite with several workers.
+
+With the default rollback journal a writer blocks all readers and a busy
+database fails at once with ``database is locked``. `configure_connection`
+switches each new SQLite connection to WAL, so readers and the single
+writer do not block each other. How long writers wait for the lock is the
+``timeout`` in the OPTIONS of the database, a ``busy_timeout`` pragma
+would override it.
+"""
+from typing import Dict
+
+from django.conf import settings
+
+
+DEFAULT_SQLITE_PRAGMAS = {
+    # readers do not block the writer and vice versa, persistent per file
+    'journal_mode': 'WAL',
+    # WAL stays consistent, only the last commits may be lost on power loss
+    'synchronous': 'NORMAL',
+    # read the database through a memory map of up to 256 MiB
+    'mmap_size': 256 * 1024 * 1024,
+    # page cache of 64 MiB per connection, negative values are KiB
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+
+def get_sqlite_pragmas() -> Dict:
+    """Returns the pragmas for new connections, empty if they are disabled."""
+    if not getattr(settings, 'SQLITE_PRODUCTION', False):
+        return {}
+    return {
+        **DEFAULT_SQLITE_PRAGMAS,
+        **getattr(settings, 'SQLITE_PRAGMAS', {})
+    }
+
+
+def configure_connection(sender, connection, **kwargs):
+    """Applies the pragmas to a new SQLite connection.
+
+    Receiver of ``django.db.backends.signals.connection_created``.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = get_sqlite_pragmas()
+    if not pragmas:
+        return
+    with connection.cursor() as cursor:
+        apply_pragmas(cursor, pragmas)
+
+
+def apply_pragmas(cursor, pragmas: Dict) -> None:
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def get_pragma_values(connection, names=DEFAULT_SQLITE_PRAGMAS) -> Dict:
+    """Returns the current values of the given pragmas of a connection."""
+    values = {}
+    with connection.cursor() as cursor:
+        for name in names:
+            cursor.execute(f'PRAGMA {name}')
+            row = cursor.fetchone()
+            values[name] = row[0] if row else None
+    return values
@@ -0,0 +1,160 @@
+"""Content hashed, precompressed static files served by Django itself.
+
+``collectstatic`` with `CompressedManifestStaticFilesStorage` writes every
+file under a name containing a hash of its content and a ``.gz`` (and
+``.br`` if the brotli package is installed) variant next to compressible
+files. `serve` delivers them from STATIC_ROOT. Hashed names never change
+their content, so browsers may keep them for a year without asking again.
+"""
+import gzip
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+from django.views.static import was_modified_since
+
+
+COMPRESSIBLE_EXTENSIONS = (
+    '.css', '.js', '.map', '.svg', '.json', '.txt', '.html', '.xml', '.ico',
+    '.eot', '.ttf', '.otf',
+)
+# smaller files do not get smaller with the headers of the compression
+MIN_SIZE = 256
+# variants which do not save at least 5% are not written
+MIN_RATIO = 0.95
+
+# (extension, Content-Encoding) in order of preference
+ENCODINGS = (('.br', 'br'), ('.gz', 'gzip'))
+
+# "q=0" in Accept-Encoding refuses an encoding
+REJECTED = re.compile(r'^q=0(\.0{0,3})?$')
+
+# ManifestStaticFilesStorage inserts the first 12 hex digits of the MD5
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.[^./]+$')
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+# files without hash (e.g. requested by their original name) are revalidated
+MUTABLE_MAX_AGE = 60
+
+
+def compress_gzip(content: bytes) -> bytes:
+    # mtime=0 makes the output reproducible
+    return gzip.compress(content, compresslevel=9, mtime=0)
+
+
+def compress_brotli(content: bytes) -> bytes:
+    import brotli
+    return brotli.compress(content, mode=brotli.MODE_TEXT)
+
+
+def get_compressors():
+    compressors = {'.gz': compress_gzip}
+    try:
+        import brotli  # noqa
+    except ImportError:
+        pass
+    else:
+        compressors['.br'] = compress_brotli
+    return compressors
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Writes compressed variants of the hashed files after collectstatic.
+
+    Until ``collectstatic`` wrote a manifest, e.g. in development and in
+    tests, the urls use the original names.
+    """
+    manifest_strict = False
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+
+        compressors = get_compressors()
+        for name in set(self.hashed_files.values()):
+            for compressed_name in self.compress(name, compressors):
+                yield name, compressed_name, True
+
+    def compress(self, name, compressors):
+        if not name.lower().endswith(COMPRESSIBLE_EXTENSIONS):
+            return
+        with self.open(name) as file:
+            content = file.read()
+        if len(content) < MIN_SIZE:
+            return
+
+        for extension, compressor in compressors.items():
+            compressed = compressor(content)
+            if len(compressed) > len(content) * MIN_RATIO:
+                continue
+            compressed_name = name + extension
+            path = self.path(compressed_name)
+            with open(path, 'wb') as file:
+                file.write(compressed)
+            yield compressed_name
+
+    def stored_name(self, name):
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+
+def accepted_encodings(request):
+    header = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    encodings = set()
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        if REJECTED.match(params.replace(' ', '')):
+            continue
+        encodings.add(coding.strip().lower())
+    return encodings
+
+
+@require_safe
+def serve(request, path):
+    """Serves a file of STATIC_ROOT, precompressed if the client accepts it."""
+    try:
+        fullpath = safe_join(settings.STATIC_ROOT, path)
+    except ValueError:
+        raise Http404('Invalid path')
+    if not os.path.isfile(fullpath):
+        raise Http404(f'{path} does not exist')
+
+    content_type, _ = mimetypes.guess_type(fullpath)
+    encodings = accepted_encodings(request)
+    encoding = None
+    for extension, coding in ENCODINGS:
+        if coding in encodings and os.path.isfile(fullpath + extension):
+            fullpath, encoding = fullpath + extension, coding
+            break
+
+    stat = os.stat(fullpath)
+    if not was_modified_since(
+        request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime
+    ):
+        response = HttpResponseNotModified()
+    else:
+        response = FileResponse(open(fullpath, 'rb'))
+        # FileResponse guesses both from the name of the compressed variant
+        response['Content-Type'] = content_type or 'application/octet-stream'
+        del response['Content-Disposition']
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        if encoding:
+            response['Content-Encoding'] = encoding
+
+    if HASHED_NAME.search(path):
+        max_age = f'max-age={IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        max_age = f'max-age={MUTABLE_MAX_AGE}'
+    response['Cache-Control'] = f'public, {max_age}'
+    if path.lower().endswith(COMPRESSIBLE_EXTENSIONS):
+        patch_vary_headers(response, ['Accept-Encoding'])
+    return response
@@ -0,0 +1,30 @@
+from contextlib import contextmanager
+
+from .queries import record_queries
+
+
+class QueryBudgetMixin:
+    """Assertions on the number of SQL queries of a block of code."""
+
+    @contextmanager
+    def assertQueryBudget(self, max_queries, max_repeats=None, using=None):
+        """Fails if the block runs more than `max_queries` queries or the
+        same statement more than `max_repeats` times.
+
+        ``with self.assertQueryBudget(5): self.client.get(url)``
+        """
+        with record_queries(using) as recorder:
+            yield recorder
+
+        repeated = recorder.repeated_statements()
+        details = ''.join(f'\n  {count}x {sql}' for sql, count in repeated)
+        self.assertLessEqual(
+            recorder.count, max_queries,
+            f'{recorder.count} queries, budget is {max_queries}.{details}'
+        )
+        if max_repeats is not None and repeated:
+            sql, count = repeated[0]
+            self.assertLessEqual(
+                count, max_repeats,
+                f'Statement executed {count} times:\n  {sql}'
+            )
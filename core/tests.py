@@ -0,0 +1,235 @@
+import asyncio
+import json
+import tempfile
+import time
+
+import httpx
+from django.test import SimpleTestCase
+from django.utils import timezone
+
+from . import api, marketplaces, standin
+from .health import HEALTH_ERROR, HEALTH_INVALID, HEALTH_OK
+
+
+def token_response(request):
+    return httpx.Response(
+        200, json={'access_token': 'Atna|new', 'expires_in': 3600}
+    )
+
+
+class RunBoundedTests(SimpleTestCase):
+
+    def test_concurrency_is_bounded_and_order_kept(self):
+        running = {'now': 0, 'max': 0}
+
+        async def func(item):
+            running['now'] += 1
+            running['max'] = max(running['max'], running['now'])
+            await asyncio.sleep(0.001 * (item % 3))
+            running['now'] -= 1
+            return item * 2
+
+        results = asyncio.run(api.run_bounded(func, range(20), concurrency=4))
+
+        self.assertEqual(results, [item * 2 for item in range(20)])
+        self.assertEqual(running['max'], 4)
+
+
+class RateLimiterTests(SimpleTestCase):
+
+    def test_calls_are_spaced(self):
+        limiter = api.MarketplaceRateLimiter(rate=50)
+
+        async def run():
+            start = time.monotonic()
+            for _ in range(5):
+                await limiter.acquire('com')
+            # another marketplace has its own limit
+            await limiter.acquire('de')
+            return time.monotonic() - start
+
+        self.assertGreaterEqual(asyncio.run(run()), 4 / 50 - 0.005)
+
+
+class RetryTests(SimpleTestCase):
+
+    def run_with_responses(self, status_codes):
+        responses = iter(status_codes)
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(next(responses))
+
+        async def run():
+            async with httpx.AsyncClient(
+                transport=httpx.MockTransport(handler)
+            ) as client:
+                async def call():
+                    resp = await client.get('https://api.amazon.com/')
+                    resp.raise_for_status()
+                    return resp.status_code
+                return await api.with_retries(call, retries=3, backoff=0)
+
+        return asyncio.run(run()), calls
+
+    def test_transient_errors_are_retried(self):
+        result, calls = self.run_with_responses([503, 429, 200])
+        self.assertEqual(result, 200)
+        self.assertEqual(len(calls), 3)
+
+    def test_client_errors_are_not_retried(self):
+        with self.assertRaises(httpx.HTTPStatusError):
+            self.run_with_responses([401, 200])
+
+
+class CheckDevicesTests(SimpleTestCase):
+
+    def test_status_per_device(self):
+        def handler(request):
+            token = dict(httpx.QueryParams(request.content.decode()))
+            status = {'Atnr|ok': 200, 'Atnr|revoked': 401}.get(
+                token['source_token'], 503
+            )
+            if status == 200:
+                return token_response(request)
+            return httpx.Response(status)
+
+        devices = [
+            {'pk': pk, 'domain': 'com', 'refresh_token': f'Atnr|{name}'}
+            for pk, name in enumerate(('ok', 'revoked', 'unavailable'))
+        ]
+        results = asyncio.run(api.check_devices(
+            devices, concurrency=2, rate=None,
+            transport=httpx.MockTransport(handler)
+        ))
+
+        self.assertEqual(
+            [r['status'] for r in results],
+            [HEALTH_OK, HEALTH_INVALID, HEALTH_ERROR]
+        )
+        self.assertEqual(results[0]['access_token'], 'Atna|new')
+        self.assertEqual(results[2]['error'], 'HTTP 503')
+
+
+class DeregisterDevicesTests(SimpleTestCase):
+
+    def test_expired_token_is_refreshed_and_errors_retried(self):
+        attempts = []
+
+        def handler(request):
+            if request.url.path == '/auth/token':
+                return token_response(request)
+            attempts.append(request.headers['Authorization'])
+            if len(attempts) == 1:
+                return httpx.Response(502)
+            return httpx.Response(200, json={})
+
+        device = {
+            'pk': 1,
+            'domain': 'de',
+            'access_token': 'Atna|expired',
+            'expires': timezone.now(),
+            'refresh_token': 'Atnr|x',
+        }
+        # the backoff of the retries is 0.5 s
+        results = asyncio.run(api.deregister_devices(
+            [device], rate=None, retries=1,
+            transport=httpx.MockTransport(handler)
+        ))
+
+        self.assertTrue(results[0]['success'])
+        self.assertEqual(attempts, ['Bearer Atna|new'] * 2)
+
+    def test_failed_deregistration_is_reported(self):
+        device = {
+            'pk': 2,
+            'domain': 'com',
+            'access_token': 'Atna|x',
+            'expires': timezone.now() + timezone.timedelta(hours=1),
+            'refresh_token': 'Atnr|x',
+        }
+        results = asyncio.run(api.deregister_devices(
+            [device], rate=None, retries=0,
+            transport=httpx.MockTransport(lambda request: httpx.Response(403))
+        ))
+
+        self.assertEqual(results[0], {
+            'pk': 2, 'success': False, 'error': 'HTTP 403'
+        })
+
+
+class RecordingHandlerTests(SimpleTestCase):
+
+    def test_logins_share_one_client(self):
+        first = standin.RecordingHandler('unused.jsonl')
+        second = standin.RecordingHandler('unused.jsonl')
+        self.assertIs(first._client, second._client)
+
+    def test_exchange_is_recorded(self):
+        client = httpx.Client(transport=httpx.MockTransport(
+            lambda request: httpx.Response(200, text='signed in')
+        ))
+        self.addCleanup(client.close)
+        with tempfile.NamedTemporaryFile('r', suffix='.jsonl') as f:
+            transport = httpx.MockTransport(
+                standin.RecordingHandler(f.name, client=client)
+            )
+            with httpx.Client(transport=transport) as login:
+                response = login.get('https://www.amazon.com/ap/signin')
+            entry = json.loads(f.readline())
+
+        self.assertEqual(response.text, 'signed in')
+        self.assertEqual(entry['url'], 'https://www.amazon.com/ap/signin')
+        self.assertEqual(entry['status_code'], 200)
+
+
+class MarketplaceTests(SimpleTestCase):
+
+    def test_every_template_is_registered(self):
+        for country_code, template in marketplaces.MARKETPLACES_TEMPLATES.items():
+            market = marketplaces.get_marketplace('country_code', country_code)
+            self.assertEqual(market.to_dict(), {
+                'country_code': country_code, **template
+            })
+            for key in ('domain', 'market_place_id', 'country'):
+                self.assertIs(
+                    marketplaces.get_marketplace(key, template[key]), market
+                )
+        self.assertEqual(
+            [code for code, _ in marketplaces.MARKETPLACES_CHOICES],
+            sorted(marketplaces.MARKETPLACES_TEMPLATES)
+        )
+
+    def test_lookups(self):
+        market = marketplaces.Marketplace.from_country_code('uk')
+        self.assertIs(marketplaces.get_marketplace('domain', 'co.uk'), market)
+        self.assertIsNone(marketplaces.get_marketplace('domain', 'nope'))
+        with self.assertRaises(Exception), \
+                self.assertLogs('core.marketplaces', 'ERROR'):
+            marketplaces.get_marketplace('nope', 'uk')
+        with self.assertRaises(Exception):
+            marketplaces.Marketplace.from_country_code('nope')
+
+    def test_registry_is_immutable(self):
+        market = marketplaces.Marketplace.from_country_code('de')
+        with self.assertRaises(AttributeError):
+            market.domain = 'com'
+        with self.assertRaises(TypeError):
+            marketplaces.MARKETPLACES['country_code']['xx'] = market
+        with self.assertRaises(TypeError):
+            marketplaces.MARKETPLACES_TEMPLATES['de']['domain'] = 'com'
+        self.assertEqual(market.domain, 'de')
+
+    def test_search_template_returns_a_new_dict(self):
+        template = marketplaces.search_template('country_code', 'de')
+        template['domain'] = 'com'
+
+        self.assertIsNot(
+            marketplaces.search_template('country_code', 'de'), template
+        )
+        self.assertEqual(
+            marketplaces.search_template('country_code', 'de')['domain'], 'de'
+        )
+        with self.assertRaises(Exception):
+            marketplaces.search_template('country_code', 'nope')
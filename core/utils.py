@@ -1,8 +1,6 @@
 import json
 from typing import Dict, Optional, TYPE_CHECKING
 
-from audible.aescipher import AESCipher
-
 if TYPE_CHECKING:
     from django.core.files.uploadedfile import UploadedFile
 
@@ -12,6 +10,9 @@ def get_data_from_uploaded_auth_file(
         password: Optional[str] = None
     ) -> Dict:
 
+    # audible pulls in httpx and more, only load it for an import
+    from audible.aescipher import AESCipher
+
     data = file.read()
     try:
         data = json.loads(data)
@@ -23,7 +24,8 @@ def get_data_from_uploaded_auth_file(
         crypter = AESCipher(password=password)
         data = crypter.from_dict(data)
 
-    data = json.loads(data)
+    if isinstance(data, str):
+        data = json.loads(data)
 
     return data
 
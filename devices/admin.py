@@ -1,7 +1,9 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.forms.models import BaseInlineFormSet
 from django.shortcuts import redirect, render
 from django.urls import path
 
+from core.marketplaces import MARKETPLACES_CHOICES
 from .models import (
     AudibleDevice,
     BearerToken,
@@ -9,8 +11,11 @@ from .models import (
     DeviceInfo,
     MessageAuthenticationCode,
     StoreAuthenticationCookie,
-    WebsiteCookie)
+    WebsiteCookie,
+    WebsiteCookieJar)
 from .forms import AuthFileImportForm
+from .jobs import check_devices_health, deregister_devices
+from .pagination import EstimatedCountPaginator
 
 
 class BearerTokenInline(admin.StackedInline):
@@ -37,9 +42,59 @@ class StoreAuthenticationCookieInline(admin.StackedInline):
     classes = ['collapse']
 
 
-class WebsiteCookieInline(admin.StackedInline):
+class PaginatedInlineFormSet(BaseInlineFormSet):
+    per_page = 20
+    page_number = 1
+
+    def get_queryset(self):
+        if not hasattr(self, '_page_queryset'):
+            qs = super().get_queryset()
+            self.total_count = qs.count()
+            self.num_pages = max(1, -(-self.total_count // self.per_page))
+            offset = (self.page_number - 1) * self.per_page
+            self._page_queryset = qs[offset:offset + self.per_page]
+        return self._page_queryset
+
+
+class WebsiteCookieInline(admin.TabularInline):
     model = WebsiteCookie
     classes = ['collapse']
+    formset = PaginatedInlineFormSet
+    template = 'admin/devices/paginated_tabular.html'
+    page_param = 'cookies_page'
+    extra = 0
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        try:
+            page_number = max(1, int(request.GET.get(self.page_param, 1)))
+        except ValueError:
+            page_number = 1
+
+        formset.page_param = self.page_param
+        formset.page_number = page_number
+        return formset
+
+
+class WebsiteCookieJarInline(admin.StackedInline):
+    model = WebsiteCookieJar
+    classes = ['collapse']
+    extra = 0
+
+
+class MarketplaceListFilter(admin.SimpleListFilter):
+    # the lookups come from the static marketplaces, a ``FieldListFilter``
+    # would run a SELECT DISTINCT over the whole devices table instead
+    title = 'marketplace'
+    parameter_name = 'country_code'
+
+    def lookups(self, request, model_admin):
+        return MARKETPLACES_CHOICES
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(country_code=self.value())
+        return queryset
 
 
 @admin.register(AudibleDevice)
@@ -50,20 +105,54 @@ class AudibleDeviceAdmin(admin.ModelAdmin):
         MessageAuthenticationCodeInline,
         BearerTokenInline,
         StoreAuthenticationCookieInline,
-        WebsiteCookieInline
+        WebsiteCookieInline,
+        WebsiteCookieJarInline
     ]
-    list_filter = ('last_modified', 'created_at')
-    list_display = ('user', 'device_name', 'created_at', 'last_modified')
+    list_filter = ('health_status', MarketplaceListFilter)
+    list_display = (
+        'user', 'device_name', 'created_at', 'last_modified',
+        'health_status', 'health_checked_at'
+    )
+    list_select_related = ('user', 'device_info')
+    readonly_fields = (
+        'last_used_at', 'api_calls', 'refresh_count', 'download_count'
+    )
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
     change_list_template = 'audible_devices_changelist.html'
+    actions = ['check_health', 'deregister']
 
+    @admin.display(ordering='device_info__device_name')
     def device_name(self, obj):
         return obj.device_info.device_name
 
+    @admin.action(description='Check credentials of selected devices')
+    def check_health(self, request, queryset):
+        stats = check_devices_health(queryset)
+        summary = ', '.join(f'{status}: {n}' for status, n in sorted(stats.items()))
+        self.message_user(
+            request, f'Checked {sum(stats.values())} devices ({summary or "-"})'
+        )
+
+    @admin.action(
+        description='Deregister and delete selected devices',
+        permissions=['delete']
+    )
+    def deregister(self, request, queryset):
+        deleted, errors = deregister_devices(queryset)
+        self.message_user(request, f'Deregistered {deleted} devices')
+        if errors:
+            self.message_user(
+                request,
+                f'{len(errors)} devices could not be deregistered',
+                level=messages.WARNING
+            )
+
     def get_queryset(self, request):
         qs = super().get_queryset(request)
         if request.user.is_superuser:
             return qs
-        return qs.filter(id=request.user.id)
+        return qs.filter(user=request.user)
 
     def get_urls(self):
         urls = super().get_urls()
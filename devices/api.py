@@ -0,0 +1,377 @@
+"""Token authenticated JSON API for the devices of a user.
+
+All list endpoints use cursor pagination (``after``/``before`` and
+``limit``). ``fields`` selects the returned fields, the credentials are
+only loaded when they are requested. Responses carry an ETag which changes
+with every change of the user's devices, so unchanged data is answered
+with ``304 Not Modified`` without touching the database.
+
+Devices can also be registered without a browser: ``POST logins/`` with
+the marketplace, email and password signs in at Amazon server side. If
+Amazon asks for a two-step code, a captcha or the password again, the
+response names the missing ``fields`` and the answers are posted to
+``logins/<login>/``.
+"""
+import json
+import logging
+import secrets
+from functools import wraps
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_http_methods
+
+from accounts.auth import token_required
+from core import routers
+from core.login import (
+    HEADLESS_SESSION_PREFIX,
+    SIGNIN_FIELDS,
+    LoginChallenge,
+    LoginError,
+    get_login_transport,
+    session_pool)
+from . import cache as device_cache
+from .forms import AudibleCreateLoginForm, AuthFileImportForm
+from .jobs import deregister_devices, deregister_registration
+from .models import AudibleDevice
+from .pagination import InvalidCursor, KeysetPaginator
+from .usage import usage_tracker
+
+
+logger = logging.getLogger(__name__)
+
+ORDERING = ('-created_at', '-id')
+DEFAULT_LIMIT = 25
+MAX_LIMIT = 100
+
+FIELDS = {
+    'id': lambda d: d.pk,
+    'name': lambda d: d.device_info.device_name,
+    'marketplace': lambda d: d.country_code,
+    'created_at': lambda d: d.created_at,
+    'last_modified': lambda d: d.last_modified,
+    'health_status': lambda d: d.health_status,
+    'health_checked_at': lambda d: d.health_checked_at,
+    'serial_number': lambda d: d.device_info.device_serial_number,
+    'device_type': lambda d: d.device_info.device_type,
+    'customer_name': lambda d: d.customer_info.name,
+    'access_token_expires': lambda d: d.bearer.access_token_expires,
+    'credentials': lambda d: d.to_auth_dict(),
+}
+DEFAULT_FIELDS = [name for name in FIELDS if name != 'credentials']
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def error_response(message, status=400):
+    return JsonResponse({'error': message}, status=status)
+
+
+def api_view(*methods):
+    """Token authentication, CSRF exemption, ETags and error handling."""
+    def decorator(view_func):
+        @condition(etag_func=get_etag)
+        def handle_errors(request, *args, **kwargs):
+            try:
+                return view_func(request, *args, **kwargs)
+            except ApiError as exc:
+                return error_response(str(exc), exc.status)
+
+        @csrf_exempt
+        @token_required
+        @require_http_methods(methods)
+        @wraps(view_func)
+        def view(request, *args, **kwargs):
+            # the user is known only now, see ReplicaMiddleware
+            with routers.use_replica(
+                routers.reads_from_replica()
+                and not routers.is_pinned(request.user.pk)
+            ):
+                response = handle_errors(request, *args, **kwargs)
+                from_replica = routers.reads_from_replica()
+            # condition() tags every GET response, errors and data of a
+            # lagging replica must not be revalidated
+            if response.status_code != 304 and (
+                response.status_code != 200 or from_replica
+            ):
+                response.headers.pop('ETag', None)
+            # clients may keep responses but have to revalidate them
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ['Authorization'])
+            return response
+        return view
+    return decorator
+
+
+def get_etag(request, *args, **kwargs):
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    return device_cache.etag(
+        request.user.pk, 'api', request.path, request.GET.urlencode()
+    )
+
+
+def get_fields(request, default=DEFAULT_FIELDS):
+    fields = request.GET.get('fields')
+    if not fields:
+        return list(default)
+    fields = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in FIELDS]
+    if unknown:
+        raise ApiError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def get_limit(request):
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise ApiError('limit must be a number')
+    return min(max(limit, 1), MAX_LIMIT)
+
+
+def get_queryset(request, fields):
+    qs = AudibleDevice.objects.filter(user=request.user)
+    if 'credentials' in fields:
+        return qs.with_credentials()
+    return qs.select_related('device_info', 'customer_info', 'bearer').defer(
+        'bearer__access_token', 'bearer__refresh_token'
+    )
+
+
+def serialize(device, fields):
+    return {name: FIELDS[name](device) for name in fields}
+
+
+def paginated_response(request, queryset, fields):
+    paginator = KeysetPaginator(queryset, ORDERING, get_limit(request))
+    try:
+        page = paginator.page(
+            after=request.GET.get('after'), before=request.GET.get('before')
+        )
+    except InvalidCursor:
+        raise ApiError('Invalid cursor')
+
+    if 'credentials' in fields:
+        for device in page:
+            usage_tracker.record(device.pk, api_calls=1)
+    return JsonResponse({
+        'results': [serialize(device, fields) for device in page],
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    })
+
+
+@api_view('GET', 'HEAD', 'POST')
+def device_list(request):
+    """Lists the devices or imports an auth file (multipart like the form)."""
+    if request.method == 'POST':
+        return import_device(request)
+
+    fields = get_fields(request)
+    qs = get_queryset(request, fields)
+    marketplace = request.GET.get('marketplace')
+    if marketplace:
+        qs = qs.filter(country_code=marketplace)
+    return paginated_response(request, qs, fields)
+
+
+def import_device(request):
+    form = AuthFileImportForm(request.POST, request.FILES)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+
+    try:
+        device = AudibleDevice.create_from_file_import(
+            file=form.cleaned_data['auth_file'],
+            password=form.cleaned_data['password'],
+            user=request.user
+        )
+    except (ValueError, KeyError, TypeError):
+        raise ApiError('The auth file could not be read')
+
+    device = get_queryset(request, DEFAULT_FIELDS).get(pk=device.pk)
+    return JsonResponse(serialize(device, DEFAULT_FIELDS), status=201)
+
+
+@api_view('GET', 'HEAD', 'DELETE')
+def device_detail(request, pk):
+    """Returns a device. DELETE deregisters it at Amazon and deletes it,
+    ``?force=1`` deletes it even if the deregistration fails. A kept
+    device is answered with 409 and the error."""
+    if request.method == 'DELETE':
+        qs = AudibleDevice.objects.filter(user=request.user, pk=pk)
+        force = request.GET.get('force') in ('1', 'true')
+        deleted, errors = deregister_devices(qs, force=force)
+        if deleted:
+            return HttpResponse(status=204)
+        if pk in errors:
+            # the device is kept, see deregister_devices()
+            raise ApiError(
+                f'Deregistration failed: {errors[pk]}', status=409
+            )
+        raise ApiError('Device not found', status=404)
+
+    fields = get_fields(request)
+    try:
+        device = get_queryset(request, fields).get(pk=pk)
+    except AudibleDevice.DoesNotExist:
+        raise ApiError('Device not found', status=404)
+    usage_tracker.record(device.pk, api_calls=1)
+    return JsonResponse(serialize(device, fields))
+
+
+@api_view('GET', 'HEAD')
+def device_credentials(request):
+    """Returns the credentials of many devices in one response.
+
+    ``ids`` restricts the response to the given devices (comma separated).
+    """
+    fields = get_fields(request, default=['id', 'credentials'])
+    if 'credentials' not in fields:
+        fields.append('credentials')
+    qs = get_queryset(request, fields)
+
+    ids = request.GET.get('ids')
+    if ids:
+        try:
+            qs = qs.filter(pk__in=[int(pk) for pk in ids.split(',')])
+        except ValueError:
+            raise ApiError('ids must be numbers')
+    return paginated_response(request, qs, fields)
+
+
+def get_request_data(request):
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            raise ApiError('Invalid JSON')
+        if not isinstance(data, dict):
+            raise ApiError('Invalid JSON')
+        return data
+    return request.POST.dict()
+
+
+def get_headless_prefix(user):
+    return f'{HEADLESS_SESSION_PREFIX}{user.pk}:'
+
+
+def get_headless_login(request, login_uuid):
+    s_obj = session_pool.get_session_by_uuid(login_uuid)
+    if (
+        s_obj is None
+        or s_obj.is_expired
+        or not s_obj.session_key.startswith(get_headless_prefix(request.user))
+    ):
+        raise ApiError('Login not found', status=404)
+    return s_obj
+
+
+def count_headless_logins(user):
+    prefix = get_headless_prefix(user)
+    return sum(
+        1 for session_key, s_obj in list(session_pool.items())
+        if session_key.startswith(prefix) and not s_obj.is_expired
+    )
+
+
+def continue_login(request, s_obj, data):
+    """Submits the sign-in forms with the answers in `data`."""
+    # httpx is only imported when a login runs
+    import httpx
+
+    answers = {
+        name: str(data[name])
+        for name in SIGNIN_FIELDS.values() if data.get(name)
+    }
+    try:
+        if s_obj.session._session is None:
+            s_obj.start_session()
+        s_obj.session.login(**answers)
+    except LoginChallenge as exc:
+        return JsonResponse({
+            'status': 'challenge',
+            'login': str(s_obj.session_uuid),
+            'expires_at': s_obj.expires_at,
+            'fields': exc.fields,
+            'message': exc.message,
+            'captcha_url': exc.captcha_url,
+        }, status=202)
+    except LoginError as exc:
+        session_pool.remove_session(s_obj.session_key)
+        raise ApiError(f'Login failed: {exc}', status=502)
+    except httpx.HTTPError:
+        logger.exception('Headless login failed')
+        session_pool.remove_session(s_obj.session_key)
+        raise ApiError('Login failed: Amazon could not be reached', status=502)
+
+    try:
+        registration_data = s_obj.session.register()
+    except Exception:
+        logger.exception('Registration of a headless login failed')
+        raise ApiError('Registration failed', status=502)
+    finally:
+        session_pool.remove_session(s_obj.session_key)
+
+    try:
+        device = AudibleDevice.create_from_registration(
+            data=registration_data, user=request.user
+        )
+    except Exception:
+        logger.exception('Saving a registered device failed')
+        # the device must not stay registered at Amazon without its credentials
+        error = deregister_registration(
+            registration_data, transport=get_login_transport()
+        )
+        if error:
+            logger.error('Deregistering the unsaved device failed: %s', error)
+        raise ApiError('The device could not be saved', status=500)
+    device = get_queryset(request, DEFAULT_FIELDS).get(pk=device.pk)
+    return JsonResponse({
+        'status': 'registered',
+        'device': serialize(device, DEFAULT_FIELDS),
+    }, status=201)
+
+
+@api_view('POST')
+def login_list(request):
+    """Starts a headless login and registers a device if no challenge
+    comes up, see the module docstring."""
+    data = get_request_data(request)
+    form = AudibleCreateLoginForm(data)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+
+    session_pool.maybe_reconcile()
+    if count_headless_logins(request.user) >= getattr(
+        settings, 'HEADLESS_LOGINS_PER_USER', 3
+    ):
+        raise ApiError(
+            'Too many open logins, answer or cancel one first', status=429
+        )
+    session_key = (
+        f'{get_headless_prefix(request.user)}{secrets.token_urlsafe(16)}'
+    )
+    s_obj = session_pool.create_session(
+        session_key=session_key,
+        country_code=form.cleaned_data['marketplace'],
+        with_username=form.cleaned_data['with_username']
+    )
+    return continue_login(request, s_obj, data)
+
+
+@api_view('POST', 'DELETE')
+def login_detail(request, login_uuid):
+    """Answers the challenge of a headless login, DELETE cancels it."""
+    s_obj = get_headless_login(request, login_uuid)
+    if request.method == 'DELETE':
+        session_pool.remove_session(s_obj.session_key)
+        return HttpResponse(status=204)
+    return continue_login(request, s_obj, get_request_data(request))
@@ -6,5 +6,5 @@ class UsersConfig(AppConfig):
     name = 'devices'
 
     def ready(self):
-        from . import signals  # noqa
+        from . import checks, signals  # noqa
 
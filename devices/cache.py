@@ -0,0 +1,147 @@
+"""Per-user cache of rendered device pages.
+
+Every user has a version number which is part of all cache keys of their
+pages. Changing a device replaces the version, so all cached pages of the
+owner become unreachable at once and expire on their own.
+
+The versions are only shared by processes which use the same cache. With
+a per-process cache like LocMemCache, other workers keep serving their
+cached pages until DEVICES_CACHE_TIMEOUT, so it is only suited for a
+single process (``manage.py check --deploy`` warns with devices.W001).
+"""
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+
+from core import routers
+
+
+KEY_PREFIX = 'devices'
+STATS_KEYS = ('hits', 'misses', 'invalidations')
+
+_local = threading.local()
+
+
+def get_cache():
+    return caches[getattr(settings, 'DEVICES_CACHE_ALIAS', 'default')]
+
+
+def get_timeout() -> int:
+    return getattr(settings, 'DEVICES_CACHE_TIMEOUT', 600)
+
+
+def _version_key(user_id: int) -> str:
+    return f'{KEY_PREFIX}:version:{user_id}'
+
+
+def _new_version() -> int:
+    # a lost version key must never bring back pages of an older version
+    return time.time_ns()
+
+
+def get_user_version(user_id: int) -> int:
+    cache = get_cache()
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = _new_version()
+        cache.add(key, version, None)
+        # another process may have added a version first, a cache which
+        # does not store anything gives a new version on every call
+        version = cache.get(key) or version
+    return version
+
+
+def invalidate_users(user_ids: Iterable[int]) -> None:
+    pending = getattr(_local, 'pending', None)
+    if pending is not None:
+        pending.update(user_ids)
+        return
+    user_ids = set(user_ids)
+    versions = {_version_key(pk): _new_version() for pk in user_ids}
+    if versions:
+        get_cache().set_many(versions, None)
+        _incr_stat('invalidations', len(versions))
+        # until the replica caught up, the pages are read from the primary
+        routers.pin_users(user_ids)
+
+
+@contextmanager
+def batch_invalidation():
+    """Collects the invalidations of the block and sends them at once."""
+    if getattr(_local, 'pending', None) is not None:
+        # nested, the outermost block invalidates
+        yield
+        return
+    _local.pending = set()
+    try:
+        yield
+    finally:
+        user_ids, _local.pending = _local.pending, None
+        invalidate_users(user_ids)
+
+
+def page_key(
+    user_id: int,
+    name: str,
+    *parts: str,
+    version: Optional[int] = None
+) -> str:
+    version = version or get_user_version(user_id)
+    digest = hashlib.md5('|'.join(map(str, parts)).encode()).hexdigest()
+    return f'{KEY_PREFIX}:page:{user_id}:{version}:{name}:{digest}'
+
+
+def etag(user_id: int, *parts: str, version: Optional[int] = None) -> str:
+    """Returns an ETag which changes with every change of the user's devices."""
+    version = version or get_user_version(user_id)
+    digest = hashlib.md5('|'.join(map(str, parts)).encode()).hexdigest()
+    return f'{version:x}-{digest}'
+
+
+def version_timestamp(version: int) -> float:
+    """Returns the time of the change which created `version`.
+
+    Nothing of the user's devices changed after this time, so it can be
+    used as Last-Modified.
+    """
+    return version / 1e9
+
+
+def get_page(key: str) -> Optional[bytes]:
+    content = get_cache().get(key)
+    _incr_stat('hits' if content is not None else 'misses')
+    return content
+
+
+def set_page(key: str, content: bytes) -> None:
+    get_cache().set(key, content, get_timeout())
+
+
+def _incr_stat(name: str, delta: int = 1) -> None:
+    cache = get_cache()
+    key = f'{KEY_PREFIX}:stats:{name}'
+    if not cache.add(key, delta, None):
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            # evicted between add and incr
+            cache.set(key, delta, None)
+
+
+def get_stats() -> Dict[str, float]:
+    keys = {f'{KEY_PREFIX}:stats:{name}': name for name in STATS_KEYS}
+    values = get_cache().get_many(keys)
+    stats = {name: values.get(key, 0) for key, name in keys.items()}
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+    return stats
+
+
+def reset_stats() -> None:
+    get_cache().delete_many([f'{KEY_PREFIX}:stats:{name}' for name in STATS_KEYS])
@@ -0,0 +1,18 @@
+from django.core.checks import Warning, register
+
+from . import cache as device_cache
+
+
+@register(deploy=True)
+def check_devices_cache(app_configs, **kwargs):
+    if device_cache.get_cache().__class__.__name__ != 'LocMemCache':
+        return []
+    return [Warning(
+        'The device pages are cached per process.',
+        hint=(
+            'Invalidations do not reach other worker processes, use a '
+            'shared cache backend (e.g. Memcached, Redis or the file based '
+            'cache) for DEVICES_CACHE_ALIAS when running more than one.'
+        ),
+        id='devices.W001',
+    )]
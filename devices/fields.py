@@ -0,0 +1,173 @@
+"""Model fields which store their values encrypted, see core.crypto.
+
+Loaded values stay encrypted until the attribute is read, so queries which
+load credentials but do not use them (lists, exports of other fields) pay
+nothing for the encryption. Saving a value which was never read writes the
+stored ciphertext back unchanged.
+
+core.crypto and with it cryptography is only imported when the first value
+is loaded or saved, not when the models are imported at startup.
+"""
+import json
+import threading
+
+from django import forms
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models.query_utils import DeferredAttribute
+
+
+def _load(key_id):
+    from .models import DataKey
+    return DataKey.objects.values_list('kek_id', 'wrapped_key').get(pk=key_id)
+
+
+def _latest(kek_ids):
+    from .models import DataKey
+    key = DataKey.objects.filter(kek_id__in=kek_ids).order_by(
+        '-created_at', '-pk'
+    ).values_list('pk', 'kek_id', 'wrapped_key', 'created_at').first()
+    if key is None:
+        return None
+    key_id, kek_id, wrapped, created_at = key
+    return key_id, kek_id, wrapped, created_at.timestamp()
+
+
+def _store(kek_id, wrapped):
+    from .models import DataKey
+    return DataKey.objects.create(kek_id=kek_id, wrapped_key=wrapped).pk
+
+
+def _is_pending(callback):
+    # a rollback discards the on_commit() callbacks of its transaction
+    connection = transaction.get_connection()
+    return any(func is callback for _, func in connection.run_on_commit)
+
+
+_keyring = None
+_keyring_lock = threading.Lock()
+
+
+def get_keyring():
+    """Returns the data key cache shared by all fields of this process."""
+    global _keyring
+    if _keyring is None:
+        from core.crypto import DataKeyCache
+
+        with _keyring_lock:
+            if _keyring is None:
+                _keyring = DataKeyCache(
+                    load=_load,
+                    latest=_latest,
+                    store=_store,
+                    max_age=getattr(
+                        settings, 'FIELD_ENCRYPTION_DATA_KEY_MAX_AGE', None
+                    ),
+                    # a new data key is saved in the transaction of the
+                    # encrypted value
+                    on_commit=transaction.on_commit,
+                    is_pending=_is_pending
+                )
+    return _keyring
+
+
+class Ciphertext:
+    """A loaded value which is decrypted on first access."""
+    __slots__ = ('token', 'decode')
+
+    def __init__(self, token, decode=None):
+        self.token = token
+        self.decode = decode
+
+    def decrypt(self):
+        value = get_keyring().decrypt(self.token)
+        return self.decode(value) if self.decode else value
+
+    def __repr__(self):
+        return '<Ciphertext>'
+
+
+def reveal(value):
+    """Returns the plaintext of values loaded by values()/values_list()."""
+    if isinstance(value, Ciphertext):
+        return value.decrypt()
+    return value
+
+
+class DecryptingAttribute(DeferredAttribute):
+    # a data descriptor, otherwise the loaded value in the instance
+    # __dict__ would be returned without calling __get__
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if isinstance(value, Ciphertext):
+            value = value.decrypt()
+            instance.__dict__[self.field.attname] = value
+        return value
+
+
+class EncryptedFieldMixin:
+    descriptor_class = DecryptingAttribute
+
+    def to_plaintext(self, value):
+        return value
+
+    def from_plaintext(self, value):
+        return value
+
+    def from_db_value(self, value, expression, connection):
+        from core.crypto import is_encrypted
+
+        if is_encrypted(value):
+            return Ciphertext(value, self.from_plaintext)
+        # not yet encrypted rows, e.g. before the data migration
+        return value
+
+    def pre_save(self, model_instance, add):
+        # an unread value is saved as it was loaded
+        value = model_instance.__dict__.get(self.attname)
+        if isinstance(value, Ciphertext):
+            return value
+        return super().pre_save(model_instance, add)
+
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+        if isinstance(value, Ciphertext):
+            return value.token
+        return get_keyring().encrypt(self.to_plaintext(value))
+
+
+class EncryptedTextField(EncryptedFieldMixin, models.TextField):
+    def to_plaintext(self, value):
+        return str(value)
+
+
+class EncryptedJSONField(EncryptedFieldMixin, models.TextField):
+    """Stores a JSON document as encrypted text."""
+
+    def to_plaintext(self, value):
+        return json.dumps(value)
+
+    def from_plaintext(self, value):
+        return json.loads(value)
+
+    def from_db_value(self, value, expression, connection):
+        value = super().from_db_value(value, expression, connection)
+        if isinstance(value, str):
+            return json.loads(value)
+        return value
+
+    def to_python(self, value):
+        if isinstance(value, str):
+            return json.loads(value)
+        return value
+
+    def formfield(self, **kwargs):
+        return models.Field.formfield(
+            self, **{'form_class': forms.JSONField, **kwargs}
+        )
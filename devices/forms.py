@@ -2,19 +2,17 @@ from django import forms
 from django.core.exceptions import ValidationError
 
 from core.marketplaces import get_marketplaces_choices
-
-
-MARKETPLACES = get_marketplaces_choices()
+from .models import AudibleDevice
 
 
 class AudibleCreateLoginForm(forms.Form):
-    marketplace = forms.ChoiceField(choices=MARKETPLACES, initial='us')
+    marketplace = forms.ChoiceField(choices=get_marketplaces_choices, initial='us')
     with_username = forms.BooleanField(required=False)
 
     def clean(self):
         cd = super().clean()
-        marketplace = cd['marketplace']
-        with_username = cd['with_username']
+        marketplace = cd.get('marketplace')
+        with_username = cd.get('with_username')
 
         if with_username and marketplace not in ('de', 'uk', 'us',):
             raise ValidationError('username login is not allowed for this marketplace.')
@@ -28,3 +26,19 @@ class AuthFileImportForm(forms.Form):
         required=False
     )
 
+
+class DeregisterDevicesForm(forms.Form):
+    devices = forms.ModelMultipleChoiceField(
+        queryset=AudibleDevice.objects.none(),
+        widget=forms.CheckboxSelectMultiple
+    )
+    force = forms.BooleanField(
+        required=False,
+        label='Delete devices even if the deregistration fails'
+    )
+
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['devices'].queryset = AudibleDevice.objects.filter(
+            user=user
+        ).select_related('device_info')
@@ -0,0 +1,170 @@
+import asyncio
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+from django.db import transaction
+from django.utils import timezone
+
+from core.marketplaces import Marketplace
+from . import cache as device_cache
+from .fields import reveal
+from .models import AudibleDevice, BearerToken
+from .ratelimit import SharedRateLimiter
+from .usage import usage_tracker
+
+
+def get_limiter(rate: Optional[float] = None):
+    from core.api import MarketplaceRateLimiter
+
+    if rate:
+        return MarketplaceRateLimiter(rate)
+    return SharedRateLimiter()
+
+
+def get_device_credentials(queryset):
+    """Yields the data needed to talk to Amazon on behalf of each device."""
+    rows = queryset.filter(bearer__isnull=False).values_list(
+        'pk', 'country_code', 'bearer__access_token',
+        'bearer__access_token_expires', 'bearer__refresh_token'
+    )
+    for pk, country_code, access_token, expires, refresh_token in rows.iterator():
+        yield {
+            'pk': pk,
+            'domain': Marketplace.from_country_code(country_code).domain,
+            'access_token': reveal(access_token),
+            'expires': expires,
+            'refresh_token': reveal(refresh_token)
+        }
+
+
+def check_devices_health(
+    queryset,
+    concurrency: int = 20,
+    rate: Optional[float] = None,
+    batch_size: int = 500
+) -> Dict[str, int]:
+    """Validates the credentials of all devices in `queryset`.
+
+    The requests follow the shared OUTBOUND_RATE_LIMITS of all workers, or
+    at most `rate` requests per second and marketplace of this job if given.
+
+    The result of each check is stored on the device together with a
+    timestamp. Access tokens obtained during the check are saved as well,
+    committed in batches of `batch_size` devices.
+    Returns the number of devices per health status.
+    """
+    # httpx is only imported when a job runs
+    from core import api
+
+    # the ORM must not be used from within the event loop
+    credentials = list(get_device_credentials(queryset))
+    user_ids = set(
+        queryset.order_by().values_list('user_id', flat=True).distinct()
+    )
+    results = asyncio.run(api.check_devices(
+        credentials,
+        concurrency=concurrency,
+        limiter=get_limiter(rate)
+    ))
+
+    checked_at = timezone.now()
+    devices = []
+    bearers = []
+    for result in results:
+        devices.append(AudibleDevice(
+            pk=result['pk'],
+            health_status=result['status'],
+            health_checked_at=checked_at
+        ))
+        if result['status'] == AudibleDevice.HEALTH_OK:
+            usage_tracker.record(
+                result['pk'], refresh_count=1, used_at=checked_at
+            )
+            bearers.append(BearerToken(
+                device_id=result['pk'],
+                access_token=result['access_token'],
+                access_token_expires=result['expires']
+            ))
+
+    # one short transaction per batch, so other workers are not locked
+    # out of the database for the whole job
+    for start in range(0, max(len(devices), len(bearers)), batch_size):
+        with transaction.atomic():
+            AudibleDevice.objects.bulk_update(
+                devices[start:start + batch_size],
+                ['health_status', 'health_checked_at']
+            )
+            BearerToken.objects.bulk_update(
+                bearers[start:start + batch_size],
+                ['access_token', 'access_token_expires']
+            )
+
+    usage_tracker.flush()
+    # bulk updates do not send signals
+    device_cache.invalidate_users(user_ids)
+
+    return Counter(result['status'] for result in results)
+
+
+def deregister_devices(
+    queryset,
+    force: bool = False,
+    concurrency: int = 10,
+    rate: Optional[float] = None,
+    retries: int = 3
+) -> Tuple[int, Dict[int, str]]:
+    """Deregisters all devices in `queryset` and deletes them afterwards.
+
+    Devices which could not be deregistered are kept unless `force` is
+    set, this includes devices without stored credentials. All rows are
+    deleted in a single transaction. Returns the number of deleted devices
+    and the errors per device pk. Rate limits as in
+    :func:`check_devices_health`.
+    """
+    from core import api
+
+    credentials = list(get_device_credentials(queryset))
+    without_bearer = queryset.filter(bearer__isnull=True).values_list(
+        'pk', flat=True
+    )
+    results = asyncio.run(api.deregister_devices(
+        credentials,
+        concurrency=concurrency,
+        retries=retries,
+        limiter=get_limiter(rate)
+    ))
+    errors = {pk: 'No credentials stored' for pk in without_bearer}
+    errors.update(
+        (r['pk'], r['error']) for r in results if not r['success']
+    )
+
+    to_delete = queryset if force else queryset.filter(
+        pk__in=[r['pk'] for r in results if r['success']]
+    )
+    with transaction.atomic():
+        deleted = to_delete.delete()[1].get(AudibleDevice._meta.label, 0)
+
+    return deleted, errors
+
+
+def deregister_registration(data: Dict, transport=None) -> Optional[str]:
+    """Deregisters a device which was registered but could not be saved.
+
+    `data` is the result of the registration. Returns the error or None.
+    """
+    from core import api
+
+    expires = data['expires']
+    if isinstance(expires, (int, float)):
+        expires = timezone.datetime.fromtimestamp(expires, timezone.utc)
+    device = {
+        'pk': None,
+        'domain': Marketplace.from_country_code(data['locale_code']).domain,
+        'access_token': data['access_token'],
+        'expires': expires,
+        'refresh_token': data['refresh_token'],
+    }
+    result, = asyncio.run(
+        api.deregister_devices([device], retries=1, transport=transport)
+    )
+    return result['error']
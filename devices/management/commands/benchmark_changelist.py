@@ -0,0 +1,63 @@
+import secrets
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from devices.benchmarks import create_fake_devices, measure
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures query count and latency of the AudibleDevice admin '
+        'changelist. All data created by the benchmark is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--devices',
+            type=int,
+            default=0,
+            help='Create this many fake devices before measuring.'
+        )
+        parser.add_argument(
+            '--pages',
+            type=int,
+            nargs='+',
+            default=[1, 10, 100],
+            help='Changelist pages to request (default: 1 10 100).'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Requests per page (default: 5).'
+        )
+
+    def handle(self, *args, **options):
+        url = reverse('admin:devices_audibledevice_changelist')
+
+        with transaction.atomic(), override_settings(ALLOWED_HOSTS=['*']):
+            admin = get_user_model().objects.create_superuser(
+                username=f'benchmark-{secrets.token_hex(4)}',
+                password=secrets.token_urlsafe()
+            )
+            if options['devices']:
+                create_fake_devices([admin], options['devices'])
+
+            client = Client()
+            client.force_login(admin)
+            for page in options['pages']:
+                result = measure(
+                    client, f'{url}?p={page}', repeat=options['repeat']
+                )
+                self.stdout.write(
+                    f"page {page:>6}: HTTP {result['status']}, "
+                    f"{result['queries']} queries, "
+                    f"median {result['median_ms']} ms "
+                    f"(min {result['min_ms']} ms, max {result['max_ms']} ms)"
+                )
+
+            transaction.set_rollback(True)
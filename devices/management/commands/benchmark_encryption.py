@@ -0,0 +1,186 @@
+import json
+import platform
+import secrets
+import statistics
+import time
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import ApiToken
+from devices import cache as device_cache
+from devices.benchmarks import create_fake_devices, measure, summarize
+from devices.fields import get_keyring
+from devices.jobs import get_device_credentials
+from devices.models import AudibleDevice
+
+
+def _median_us(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1_000_000)
+    return round(statistics.median(timings), 2)
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures the cost of the encrypted credential fields: encryption '
+        'and decryption per field with cold and cached data keys, the batch '
+        'loaders with and without reading the credentials and the device '
+        'views. Prints the results as JSON, all data created by the '
+        'benchmark is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--devices', type=int, default=500,
+            help='Devices of the measured user (default: 500).'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Repetitions per measurement (default: 5).'
+        )
+        parser.add_argument(
+            '--label', default='',
+            help='Free text stored with the results, e.g. the version.'
+        )
+        parser.add_argument(
+            '--output', help='Write the JSON to this file instead of stdout.'
+        )
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        with transaction.atomic(), override_settings(ALLOWED_HOSTS=['*']):
+            user = get_user_model().objects.create_superuser(
+                username=f'benchmark-{secrets.token_hex(4)}',
+                password=secrets.token_urlsafe()
+            )
+            create_fake_devices([user], options['devices'])
+            devices = AudibleDevice.objects.filter(user=user)
+
+            results = {
+                'fields': self.benchmark_fields(repeat * 200),
+                'loaders': self.benchmark_loaders(devices, repeat),
+                'views': self.benchmark_views(user, devices.first(), repeat),
+            }
+            transaction.set_rollback(True)
+
+        report = {
+            'label': options['label'],
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'devices': options['devices'],
+            'repeat': repeat,
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def benchmark_fields(self, repeat):
+        # about the size of an access token
+        plaintext = 'Atna|' + secrets.token_urlsafe(300)
+        keyring = get_keyring()
+        token = keyring.encrypt(plaintext)
+
+        def decrypt_cold():
+            keyring.clear()
+            keyring.decrypt(token)
+
+        results = {
+            'plaintext_bytes': len(plaintext),
+            'encrypt_us': _median_us(lambda: keyring.encrypt(plaintext), repeat),
+            'decrypt_us': _median_us(lambda: keyring.decrypt(token), repeat),
+            # loads and unwraps the data key, once per key and process
+            'decrypt_cold_us': _median_us(decrypt_cold, max(repeat // 100, 5)),
+        }
+        self.stderr.write(
+            f"field: encrypt {results['encrypt_us']} us, decrypt "
+            f"{results['decrypt_us']} us ({results['decrypt_cold_us']} us "
+            f"with a cold data key)"
+        )
+        return results
+
+    def benchmark_loaders(self, devices, repeat):
+        def load():
+            return list(devices.with_credentials())
+
+        def load_and_read():
+            for device in devices.with_credentials():
+                device.to_auth_dict()
+
+        def load_display():
+            return list(devices.for_display())
+
+        def load_job_credentials():
+            return list(get_device_credentials(devices))
+
+        results = {}
+        for name, func in (
+            ('for_display', load_display),
+            ('with_credentials', load),
+            ('with_credentials_read', load_and_read),
+            ('job_credentials', load_job_credentials),
+        ):
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                func()
+                timings.append((time.perf_counter() - start) * 1000)
+            results[name] = summarize(timings)
+
+        count = devices.count()
+        decrypt_ms = (
+            results['with_credentials_read']['p50_ms']
+            - results['with_credentials']['p50_ms']
+        )
+        results['read_overhead_per_device_us'] = round(
+            max(decrypt_ms, 0.0) * 1000 / max(count, 1), 2
+        )
+        self.stderr.write(
+            f"loaders: {count} devices, with_credentials "
+            f"{results['with_credentials']['p50_ms']} ms, reading all "
+            f"credentials {results['with_credentials_read']['p50_ms']} ms"
+        )
+        return results
+
+    def benchmark_views(self, user, device, repeat):
+        def invalidate():
+            device_cache.invalidate_users([user.pk])
+
+        client = Client()
+        client.force_login(user)
+        _, key = ApiToken.create_token(user, 'benchmark')
+        api_client = Client(HTTP_AUTHORIZATION=f'Bearer {key}')
+        benchmarks = {
+            'device_list': dict(url=reverse('own_devices_list'), before=invalidate),
+            'device_detail': dict(url=device.get_absolute_url(), before=invalidate),
+            'device_credentials': dict(
+                url=reverse('own_device_credentials', args=[device.pk])
+            ),
+            'api_device_credentials': dict(
+                url=reverse('api_device_credentials'), client=api_client
+            ),
+        }
+        results = {}
+        for name, kwargs in benchmarks.items():
+            kwargs.setdefault('client', client)
+            results[name] = measure(repeat=repeat, **kwargs)
+            self.stderr.write(
+                f"{name}: HTTP {results[name]['status']}, "
+                f"{results[name]['queries']} queries, "
+                f"median {results[name]['median_ms']} ms"
+            )
+        return results
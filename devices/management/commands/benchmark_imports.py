@@ -0,0 +1,120 @@
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+# modules which should not be loaded by processes that never use them
+HEAVY_MODULES = ('httpx', 'audible', 'bs4', 'PIL', 'rsa')
+
+TARGETS = {
+    'check': ['manage.py', 'check'],
+    'worker': [
+        '-c',
+        'import myaudible.wsgi\n'
+        'from django.urls import get_resolver\n'
+        'get_resolver().url_patterns'
+    ],
+}
+
+
+def parse_importtime(output):
+    """Returns (module, self µs, cumulative µs, depth) per imported module."""
+    modules = []
+    for line in output.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            own, cumulative, indent, name = match.groups()
+            modules.append((name, int(own), int(cumulative), len(indent) // 2))
+    return modules
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures the startup of `manage.py check` and of a WSGI worker '
+        'with `python -X importtime` in fresh interpreters.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'targets', nargs='*', default=list(TARGETS),
+            help=f'What to measure: {", ".join(TARGETS)} (default: all).'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Interpreter starts per target (default: 5).'
+        )
+        parser.add_argument(
+            '--top', type=int, default=15,
+            help='Number of slowest top-level imports shown (default: 15).'
+        )
+        parser.add_argument(
+            '--json', action='store_true', help='Print the results as JSON.'
+        )
+
+    def handle(self, *args, **options):
+        unknown = set(options['targets']) - set(TARGETS)
+        if unknown:
+            raise CommandError(f'Unknown targets: {", ".join(sorted(unknown))}')
+
+        results = {
+            target: self.measure(target, options['repeat'], options['top'])
+            for target in options['targets']
+        }
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for target, result in results.items():
+            self.stdout.write(
+                f"{target}: median {result['wall_ms']} ms wall, "
+                f"{result['import_ms']} ms imports, "
+                f"{result['modules']} modules"
+            )
+            if result['heavy_modules']:
+                self.stdout.write(
+                    f"  heavy modules: {', '.join(result['heavy_modules'])}"
+                )
+            for name, cumulative_ms in result['top']:
+                self.stdout.write(f'  {cumulative_ms:>8.1f} ms  {name}')
+
+    def measure(self, target, repeat, top):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'myaudible.settings'}
+        command = [sys.executable, '-X', 'importtime'] + TARGETS[target]
+        walls, runs = [], []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            process = subprocess.run(
+                command,
+                cwd=settings.BASE_DIR,
+                env=env,
+                capture_output=True,
+                text=True
+            )
+            walls.append((time.perf_counter() - start) * 1000)
+            if process.returncode:
+                raise CommandError(f'{target} failed:\n{process.stderr}')
+            runs.append(parse_importtime(process.stderr))
+
+        # the module list is the same for every run, use the median run
+        totals = [sum(m[2] for m in run if m[3] == 0) for run in runs]
+        modules = runs[totals.index(statistics.median_low(totals))]
+        top_level = sorted(
+            (m for m in modules if m[3] == 0), key=lambda m: m[2], reverse=True
+        )
+        names = {m[0] for m in modules}
+        return {
+            'wall_ms': round(statistics.median(walls), 1),
+            'import_ms': round(statistics.median(totals) / 1000, 1),
+            'modules': len(modules),
+            'heavy_modules': [name for name in HEAVY_MODULES if name in names],
+            'top': [(m[0], round(m[2] / 1000, 1)) for m in top_level[:top]],
+        }
@@ -0,0 +1,149 @@
+import resource
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client, override_settings
+
+from accounts.models import ApiToken
+from core.login import session_pool
+from core.standin import get_standin
+from devices.benchmarks import (
+    LoginFlowError, simulate_headless_login, simulate_login, summarize)
+
+
+def peak_rss_kb():
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Command(BaseCommand):
+    help = (
+        'Drives concurrent simulated users through the device login '
+        '(RegisterDeviceView, register_device, device creation) or the '
+        'headless login API against the local Amazon stand-in. The '
+        'benchmark users and their devices are deleted afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=50,
+            help='Number of simulated logins (default: 50).'
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=10,
+            help='Logins running at the same time (default: 10).'
+        )
+        parser.add_argument(
+            '--marketplace', default='us',
+            help='Country code of the marketplace (default: us).'
+        )
+        parser.add_argument(
+            '--latency', type=float, default=0.0,
+            help='Simulated network latency per request in seconds.'
+        )
+        parser.add_argument(
+            '--otp', action='store_true',
+            help='Require a two-step verification code.'
+        )
+        parser.add_argument(
+            '--headless', action='store_true',
+            help='Log in through the headless login API instead of the proxy.'
+        )
+
+    def handle(self, *args, **options):
+        standin_config = {
+            'latency': options['latency'],
+            'otp_code': '123456' if options['otp'] else None,
+        }
+        prefix = f'benchmark-login-{secrets.token_hex(4)}'
+        users = get_user_model().objects.bulk_create([
+            get_user_model()(username=f'{prefix}-{index}')
+            for index in range(options['users'])
+        ])
+        users = list(get_user_model().objects.filter(username__startswith=prefix))
+
+        peak = {'sessions': 0, 'memory': 0}
+        sampling = threading.Event()
+
+        def sample_sessions():
+            while not sampling.wait(0.01):
+                sessions = list(session_pool.values())
+                peak['sessions'] = max(peak['sessions'], len(sessions))
+                peak['memory'] = max(
+                    peak['memory'],
+                    sum(s_obj.session.memory_usage() for s_obj in sessions)
+                )
+
+        def run(user):
+            if options['headless']:
+                _, key = ApiToken.create_token(user, 'benchmark')
+                client = Client(HTTP_AUTHORIZATION=f'Bearer {key}')
+                simulate = simulate_headless_login
+            else:
+                client = Client()
+                client.force_login(user)
+                simulate = simulate_login
+            try:
+                return simulate(
+                    client,
+                    marketplace=options['marketplace'],
+                    email=f'{user.username}@example.com',
+                    password=get_standin().password,
+                    otp_code=standin_config['otp_code']
+                )
+            except LoginFlowError as exc:
+                return exc
+            finally:
+                connections.close_all()
+
+        settings = override_settings(
+            ALLOWED_HOSTS=['*'],
+            AUDIBLE_LOGIN_TRANSPORT='core.standin.standin_transport',
+            AUDIBLE_LOGIN_STANDIN=standin_config
+        )
+        sampler = threading.Thread(target=sample_sessions, daemon=True)
+        rss_before = peak_rss_kb()
+        try:
+            with settings:
+                sampler.start()
+                start = time.perf_counter()
+                with ThreadPoolExecutor(options['concurrency']) as executor:
+                    results = list(executor.map(run, users))
+                duration = time.perf_counter() - start
+                sampling.set()
+                sampler.join()
+        finally:
+            get_user_model().objects.filter(username__startswith=prefix).delete()
+        rss_after = peak_rss_kb()
+
+        errors = [r for r in results if isinstance(r, Exception)]
+        timings = [r for r in results if not isinstance(r, Exception)]
+        if not timings:
+            raise CommandError(f'All logins failed, first error: {errors[0]}')
+
+        self.stdout.write(
+            f'{len(timings)} logins in {duration:.2f} s '
+            f'({len(timings) / duration:.1f} logins/s), {len(errors)} failed'
+        )
+        for step in timings[0]:
+            stats = summarize([t[step] for t in timings])
+            self.stdout.write(
+                f"{step:>12}: p50 {stats['p50_ms']} ms, "
+                f"p95 {stats['p95_ms']} ms, p99 {stats['p99_ms']} ms, "
+                f"max {stats['max_ms']} ms"
+            )
+        sessions = max(peak['sessions'], 1)
+        self.stdout.write(
+            f"peak RSS {rss_after / 1024:.1f} MiB "
+            f"(+{(rss_after - rss_before) / 1024:.1f} MiB), "
+            f"peak {peak['sessions']} login sessions holding "
+            f"{peak['memory'] / 1024:.1f} KiB, "
+            f"~{(rss_after - rss_before) / sessions:.1f} KiB RSS per session"
+        )
+        if errors:
+            self.stderr.write(f'First error: {errors[0]}')
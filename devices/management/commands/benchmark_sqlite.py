@@ -0,0 +1,202 @@
+import json
+import os
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core.sqlite import DEFAULT_SQLITE_PRAGMAS, apply_pragmas, get_pragma_values
+from devices.benchmarks import summarize
+
+
+MODES = {
+    # Django's defaults: rollback journal, 5 s lock timeout
+    'default': ({}, 5.0),
+    'production': (DEFAULT_SQLITE_PRAGMAS, 20.0),
+}
+
+SCHEMA = '''
+    CREATE TABLE device (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        access_token TEXT NOT NULL,
+        last_modified REAL NOT NULL
+    );
+    CREATE INDEX device_user_id ON device (user_id);
+'''
+
+
+def open_database(path, pragmas, timeout):
+    # autocommit, transactions are opened explicitly like Django does
+    db = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+    apply_pragmas(db.cursor(), pragmas)
+    return db
+
+
+def create_database(path, rows, users):
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA)
+    db.executemany(
+        'INSERT INTO device (user_id, access_token, last_modified) '
+        'VALUES (?, ?, ?)',
+        (
+            (index % users, secrets.token_urlsafe(300), time.time())
+            for index in range(rows)
+        )
+    )
+    db.commit()
+    db.close()
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs concurrent readers and writers against a scratch SQLite '
+        'database, once with the default connection settings and once with '
+        'the production pragmas (WAL, synchronous=NORMAL) and lock timeout, '
+        'and reports the throughput and lock errors of both.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'modes', nargs='*', default=list(MODES),
+            help=f'Modes to compare: {", ".join(MODES)} (default: all).'
+        )
+        parser.add_argument(
+            '--readers', type=int, default=8,
+            help='Threads listing the devices of a user (default: 8).'
+        )
+        parser.add_argument(
+            '--writers', type=int, default=2,
+            help='Threads refreshing access tokens (default: 2).'
+        )
+        parser.add_argument(
+            '--duration', type=float, default=5.0,
+            help='Seconds per mode (default: 5).'
+        )
+        parser.add_argument(
+            '--rows', type=int, default=20000,
+            help='Devices in the scratch database (default: 20000).'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=50,
+            help='Token updates per write transaction (default: 50).'
+        )
+        parser.add_argument(
+            '--json', action='store_true', help='Print the results as JSON.'
+        )
+
+    def handle(self, *args, **options):
+        unknown = set(options['modes']) - set(MODES)
+        if unknown:
+            raise CommandError(f'Unknown modes: {", ".join(sorted(unknown))}')
+
+        results = {}
+        for mode in options['modes']:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'benchmark.sqlite3')
+                create_database(path, options['rows'], users=100)
+                results[mode] = self.run(path, mode, options)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        if connection.vendor == 'sqlite':
+            self.stdout.write(
+                f'Current database connection: {get_pragma_values(connection)}'
+            )
+        for mode, result in results.items():
+            self.stdout.write(
+                f"{mode:>10}: {result['reads_per_s']} reads/s, "
+                f"{result['writes_per_s']} writes/s, "
+                f"{result['locked']} 'database is locked' errors"
+            )
+            for kind in ('read', 'write'):
+                stats = result[f'{kind}_latency']
+                self.stdout.write(
+                    f"{kind:>16}: p50 {stats['p50_ms']} ms, "
+                    f"p95 {stats['p95_ms']} ms, p99 {stats['p99_ms']} ms, "
+                    f"max {stats['max_ms']} ms"
+                )
+
+    def run(self, path, mode, options):
+        pragmas, timeout = MODES[mode]
+        rows = options['rows']
+        batch_size = options['batch_size']
+        deadline = time.perf_counter() + options['duration']
+        lock = threading.Lock()
+        latencies = {'read': [], 'write': []}
+        counts = {'read': 0, 'write': 0, 'locked': 0}
+
+        def record(kind, milliseconds, operations=1):
+            with lock:
+                latencies[kind].append(milliseconds)
+                counts[kind] += operations
+
+        def read(db, worker):
+            db.execute(
+                'SELECT id, access_token, last_modified FROM device '
+                'WHERE user_id = ? ORDER BY id DESC LIMIT 25',
+                (worker % 100,)
+            ).fetchall()
+            return 1
+
+        def write(db, worker):
+            start = secrets.randbelow(rows - batch_size) + 1
+            db.execute('BEGIN')
+            try:
+                db.executemany(
+                    'UPDATE device SET access_token = ?, last_modified = ? '
+                    'WHERE id = ?',
+                    [
+                        (secrets.token_urlsafe(300), time.time(), pk)
+                        for pk in range(start, start + batch_size)
+                    ]
+                )
+                db.execute('COMMIT')
+            except sqlite3.Error:
+                db.execute('ROLLBACK')
+                raise
+            return batch_size
+
+        def work(kind, operation, worker):
+            db = open_database(path, pragmas, timeout)
+            try:
+                while time.perf_counter() < deadline:
+                    start = time.perf_counter()
+                    try:
+                        done = operation(db, worker)
+                    except sqlite3.OperationalError as exc:
+                        if 'locked' not in str(exc):
+                            raise
+                        with lock:
+                            counts['locked'] += 1
+                        continue
+                    record(kind, (time.perf_counter() - start) * 1000, done)
+            finally:
+                db.close()
+
+        jobs = [
+            ('read', read, index) for index in range(options['readers'])
+        ] + [
+            ('write', write, index) for index in range(options['writers'])
+        ]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(len(jobs)) as executor:
+            for future in [executor.submit(work, *job) for job in jobs]:
+                future.result()
+        duration = time.perf_counter() - start
+
+        return {
+            'duration_s': round(duration, 2),
+            'reads_per_s': round(counts['read'] / duration),
+            'writes_per_s': round(counts['write'] / duration),
+            'locked': counts['locked'],
+            'read_latency': summarize(latencies['read'] or [0.0]),
+            'write_latency': summarize(latencies['write'] or [0.0]),
+        }
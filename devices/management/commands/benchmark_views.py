@@ -0,0 +1,146 @@
+import json
+import math
+import platform
+import secrets
+
+import django
+from audible.aescipher import AESCipher
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from devices import cache as device_cache
+from devices.admin import AudibleDeviceAdmin
+from devices.benchmarks import create_fake_devices, measure
+from devices.models import AudibleDevice
+from devices.pagination import KeysetPaginator
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures queries, latency and peak memory of the device list, '
+        'device detail, admin changelist and import views and prints the '
+        'results as JSON. All data created by the benchmark is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=1,
+            help='Users with devices besides the measured one (default: 1).'
+        )
+        parser.add_argument(
+            '--devices', type=int, default=1000,
+            help='Devices per user (default: 1000).'
+        )
+        parser.add_argument(
+            '--cookies', type=int, default=5,
+            help='Website cookies per device (default: 5).'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Requests per view (default: 5).'
+        )
+        parser.add_argument(
+            '--label', default='',
+            help='Free text stored with the results, e.g. the version.'
+        )
+        parser.add_argument(
+            '--output', help='Write the JSON to this file instead of stdout.'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic(), override_settings(ALLOWED_HOSTS=['*']):
+            User = get_user_model()
+            prefix = f'benchmark-{secrets.token_hex(4)}'
+            user = User.objects.create_superuser(
+                username=prefix, password=secrets.token_urlsafe()
+            )
+            others = User.objects.bulk_create([
+                User(username=f'{prefix}-{index}')
+                for index in range(options['users'])
+            ])
+            others = list(User.objects.filter(username__startswith=f'{prefix}-'))
+            create_fake_devices(
+                [user] + others,
+                options['devices'],
+                cookies_per_device=options['cookies']
+            )
+
+            client = Client()
+            client.force_login(user)
+            results = self.run_benchmarks(client, user, options['repeat'])
+
+            transaction.set_rollback(True)
+
+        report = {
+            'label': options['label'],
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'users': options['users'] + 1,
+            'devices_per_user': options['devices'],
+            'cookies_per_device': options['cookies'],
+            'repeat': options['repeat'],
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def run_benchmarks(self, client, user, repeat):
+        def invalidate():
+            device_cache.invalidate_users([user.pk])
+
+        devices = AudibleDevice.objects.filter(user=user)
+        device = devices.first()
+        list_url = reverse('own_devices_list')
+        sort = KeysetPaginator(devices, ('-created_at', '-id'), 25)
+        middle = devices.order_by('-created_at', '-id')[devices.count() // 2]
+        changelist_url = reverse('admin:devices_audibledevice_changelist')
+        # the changelist shows the devices of all users
+        per_page = AudibleDeviceAdmin.list_per_page
+        last_page = max(math.ceil(AudibleDevice.objects.count() / per_page), 1)
+        import_url = reverse('import_auth_file')
+        password = secrets.token_urlsafe()
+        auth_file = json.dumps(AESCipher(password).to_dict(json.dumps(
+            AudibleDevice.objects.with_credentials().get(pk=device.pk).to_auth_dict()
+        )))
+
+        def import_data():
+            return {
+                'auth_file': SimpleUploadedFile('auth.json', auth_file.encode()),
+                'password': password,
+            }
+
+        benchmarks = {
+            'device_list': dict(url=list_url, before=invalidate),
+            'device_list_cached': dict(url=list_url),
+            'device_list_middle': dict(
+                url=f'{list_url}?after={sort.encode_cursor(middle)}',
+                before=invalidate
+            ),
+            'device_list_search': dict(url=f'{list_url}?q=iPhone', before=invalidate),
+            'device_detail': dict(url=device.get_absolute_url(), before=invalidate),
+            'device_detail_cached': dict(url=device.get_absolute_url()),
+            'admin_changelist': dict(url=changelist_url),
+            'admin_changelist_last': dict(url=f'{changelist_url}?p={last_page}'),
+            'import_form': dict(url=import_url),
+            'import_file': dict(url=import_url, method='post', data=import_data),
+        }
+        results = {}
+        for name, kwargs in benchmarks.items():
+            results[name] = measure(client, repeat=repeat, **kwargs)
+            self.stderr.write(
+                f"{name}: HTTP {results[name]['status']}, "
+                f"{results[name]['queries']} queries, "
+                f"median {results[name]['median_ms']} ms"
+            )
+        return results
@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from devices.jobs import check_devices_health
+from devices.models import AudibleDevice
+
+
+class Command(BaseCommand):
+    help = 'Validates the credentials of stored Audible devices.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', help='Only check devices of this username.'
+        )
+        parser.add_argument(
+            '--country-code', help='Only check devices of this marketplace.'
+        )
+        parser.add_argument(
+            '--status',
+            choices=[status for status, _ in AudibleDevice.HEALTH_CHOICES],
+            help='Only check devices with this health status.'
+        )
+        parser.add_argument(
+            '--older-than',
+            type=float,
+            metavar='HOURS',
+            help='Only check devices not checked in the last HOURS hours.'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=20,
+            help='Maximum number of requests in flight (default: 20).'
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            help=(
+                'Maximum requests per second and marketplace of this run '
+                '(default: the shared OUTBOUND_RATE_LIMITS of all workers).'
+            )
+        )
+
+    def handle(self, *args, **options):
+        qs = AudibleDevice.objects.all()
+        if options['user']:
+            qs = qs.filter(user__username=options['user'])
+        if options['country_code']:
+            qs = qs.filter(country_code=options['country_code'])
+        if options['status']:
+            qs = qs.filter(health_status=options['status'])
+        if options['older_than'] is not None:
+            threshold = timezone.now() - timezone.timedelta(
+                hours=options['older_than']
+            )
+            qs = qs.exclude(health_checked_at__gte=threshold)
+
+        start = timezone.now()
+        stats = check_devices_health(
+            qs,
+            concurrency=options['concurrency'],
+            rate=options['rate']
+        )
+        elapsed = (timezone.now() - start).total_seconds()
+
+        total = sum(stats.values())
+        summary = ', '.join(f'{status}: {n}' for status, n in sorted(stats.items()))
+        self.stdout.write(self.style.SUCCESS(
+            f'Checked {total} devices in {elapsed:.1f}s ({summary or "-"})'
+        ))
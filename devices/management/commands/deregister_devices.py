@@ -0,0 +1,85 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from devices.jobs import deregister_devices
+from devices.models import AudibleDevice
+
+
+class Command(BaseCommand):
+    help = 'Deregisters Audible devices on Amazon and deletes them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'ids', nargs='*', type=int, help='Only deregister these devices.'
+        )
+        parser.add_argument(
+            '--user', help='Only deregister devices of this username.'
+        )
+        parser.add_argument(
+            '--country-code',
+            help='Only deregister devices of this marketplace.'
+        )
+        parser.add_argument(
+            '--status',
+            choices=[status for status, _ in AudibleDevice.HEALTH_CHOICES],
+            help='Only deregister devices with this health status.'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Delete devices even if the deregistration fails.'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=10,
+            help='Maximum number of requests in flight (default: 10).'
+        )
+        parser.add_argument(
+            '--retries',
+            type=int,
+            default=3,
+            help='Retries per request on transient errors (default: 3).'
+        )
+        parser.add_argument(
+            '--noinput', '--no-input',
+            action='store_false',
+            dest='interactive',
+            help='Do not prompt for confirmation.'
+        )
+
+    def handle(self, *args, **options):
+        qs = AudibleDevice.objects.all()
+        if options['ids']:
+            qs = qs.filter(pk__in=options['ids'])
+        if options['user']:
+            qs = qs.filter(user__username=options['user'])
+        if options['country_code']:
+            qs = qs.filter(country_code=options['country_code'])
+        if options['status']:
+            qs = qs.filter(health_status=options['status'])
+
+        if not (options['ids'] or options['user'] or options['country_code']
+                or options['status']):
+            raise CommandError(
+                'Refusing to deregister all devices. Please select devices '
+                'by id, --user, --country-code or --status.'
+            )
+
+        count = qs.count()
+        if options['interactive']:
+            answer = input(f'Deregister and delete {count} devices? [y/N] ')
+            if answer.lower() != 'y':
+                raise CommandError('Deregistration cancelled.')
+
+        deleted, errors = deregister_devices(
+            qs,
+            force=options['force'],
+            concurrency=options['concurrency'],
+            retries=options['retries']
+        )
+
+        for pk, error in errors.items():
+            self.stderr.write(f'Device {pk}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {deleted} of {count} devices, {len(errors)} failed.'
+        ))
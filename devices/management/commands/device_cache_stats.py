@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from devices import cache as device_cache
+
+
+class Command(BaseCommand):
+    help = (
+        'Shows hit/miss statistics of the device page cache. Needs a cache '
+        'backend shared between processes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset', action='store_true', help='Reset the statistics.'
+        )
+
+    def handle(self, *args, **options):
+        stats = device_cache.get_stats()
+        self.stdout.write(
+            f"hits: {stats['hits']}, misses: {stats['misses']}, "
+            f"hit rate: {stats['hit_rate']:.1%}, "
+            f"invalidations: {stats['invalidations']}"
+        )
+        if options['reset']:
+            device_cache.reset_stats()
+            self.stdout.write('Statistics reset.')
@@ -0,0 +1,73 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.crypto import (
+    generate_key_encryption_key,
+    get_key_encryption_keys,
+    unwrap_data_key,
+    wrap_data_key)
+from devices.fields import get_keyring
+from devices.models import DataKey
+
+
+class Command(BaseCommand):
+    help = (
+        'Shows the data keys of the encrypted credentials per key '
+        'encryption key, generates a new key for FIELD_ENCRYPTION_KEYS or '
+        'rewraps all data keys with the current one.'
+    )
+
+    def add_arguments(self, parser):
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument(
+            '--generate', action='store_true',
+            help='Print a new key for FIELD_ENCRYPTION_KEYS.'
+        )
+        group.add_argument(
+            '--rewrap', action='store_true',
+            help='Wrap all data keys with the first of FIELD_ENCRYPTION_KEYS.'
+        )
+
+    def handle(self, *args, **options):
+        if options['generate']:
+            self.stdout.write(generate_key_encryption_key())
+            return
+
+        kek_ids = list(get_key_encryption_keys())
+        if options['rewrap']:
+            self.rewrap(kek_ids[0])
+            return
+
+        counts = Counter(DataKey.objects.values_list('kek_id', flat=True))
+        for kek_id in kek_ids + sorted(set(counts) - set(kek_ids)):
+            if kek_id == kek_ids[0]:
+                state = 'current'
+            elif kek_id in kek_ids:
+                state = 'unwrap only'
+            else:
+                state = 'missing'
+            self.stdout.write(
+                f'{kek_id}  {counts[kek_id]:5} data keys  ({state})'
+            )
+
+    def rewrap(self, current_kek_id):
+        rewrapped = 0
+        with transaction.atomic():
+            keys = DataKey.objects.select_for_update().exclude(
+                kek_id=current_kek_id
+            )
+            for key in keys:
+                try:
+                    data_key = unwrap_data_key(key.kek_id, key.wrapped_key)
+                except Exception as exc:
+                    raise CommandError(f'Data key {key.pk}: {exc}')
+                key.kek_id, key.wrapped_key = wrap_data_key(data_key)
+                key.save(update_fields=['kek_id', 'wrapped_key'])
+                rewrapped += 1
+        get_keyring().clear()
+        self.stdout.write(
+            f'Rewrapped {rewrapped} data keys with {current_kek_id}. The '
+            f'other FIELD_ENCRYPTION_KEYS can be removed now.'
+        )
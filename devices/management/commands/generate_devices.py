@@ -0,0 +1,84 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from devices.benchmarks import create_fake_devices
+
+
+class Command(BaseCommand):
+    help = (
+        'Creates users with fake Audible devices (all related rows and '
+        'website cookies) through batched inserts. The credentials are '
+        'random and not valid on Amazon.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=10,
+            help='Number of users to create (default: 10).'
+        )
+        parser.add_argument(
+            '--devices', type=int, default=100,
+            help='Devices per user (default: 100).'
+        )
+        parser.add_argument(
+            '--cookies', type=int, default=5,
+            help='Website cookies per device (default: 5).'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Devices per insert batch (default: 500).'
+        )
+        parser.add_argument(
+            '--prefix', default='synthetic',
+            help='Prefix of the usernames (default: synthetic).'
+        )
+        parser.add_argument(
+            '--delete', action='store_true',
+            help='Delete the users with the prefix and their devices instead.'
+        )
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        prefix = options['prefix'] + '-'
+
+        if options['delete']:
+            deleted, _ = User.objects.filter(username__startswith=prefix).delete()
+            self.stdout.write(f'Deleted {deleted} objects.')
+            return
+
+        start = time.perf_counter()
+        with transaction.atomic():
+            offset = User.objects.filter(username__startswith=prefix).count()
+            usernames = [
+                f'{prefix}{index}'
+                for index in range(offset, offset + options['users'])
+            ]
+            users = [User(username=username) for username in usernames]
+            for user in users:
+                user.set_unusable_password()
+            User.objects.bulk_create(users, batch_size=options['batch_size'])
+        users = list(User.objects.filter(username__in=usernames))
+
+        # commit every batch, a single long transaction would lock out all
+        # other writers of a SQLite database until the end
+        created = 0
+        users_per_batch = max(
+            options['batch_size'] // max(options['devices'], 1), 1
+        )
+        for index in range(0, len(users), users_per_batch):
+            with transaction.atomic():
+                created += create_fake_devices(
+                    users[index:index + users_per_batch],
+                    options['devices'],
+                    cookies_per_device=options['cookies'],
+                    batch_size=options['batch_size']
+                )
+
+        duration = time.perf_counter() - start
+        self.stdout.write(
+            f'Created {len(users)} users with {created} devices '
+            f'in {duration:.1f} s ({created / duration:.0f} devices/s).'
+        )
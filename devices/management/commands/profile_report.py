@@ -0,0 +1,85 @@
+import glob
+import io
+import os
+import pstats
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import profiling
+from core.middleware import get_cpu_profiler_settings
+
+
+class Command(BaseCommand):
+    help = (
+        'Aggregates the request profiles of the CPU profiler. Collapsed '
+        'stacks are merged into one flamegraph.pl/speedscope input, pstats '
+        'profiles into a table of the most expensive functions.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--directory',
+            help='Profile directory, defaults to CPU_PROFILER["DIRECTORY"].'
+        )
+        parser.add_argument(
+            '--view', action='append', default=[],
+            help='Only use profiles of this view. Can be given more than once.'
+        )
+        parser.add_argument(
+            '--output', help='Write the report to this file instead of stdout.'
+        )
+        parser.add_argument(
+            '--sort', default='cumulative',
+            help='Sort key of the pstats report.'
+        )
+        parser.add_argument(
+            '--limit', type=int, default=40,
+            help='Number of functions in the pstats report.'
+        )
+        parser.add_argument(
+            '--delete', action='store_true',
+            help='Delete the aggregated profiles.'
+        )
+
+    def handle(self, *args, **options):
+        directory = options['directory'] or get_cpu_profiler_settings()['DIRECTORY']
+        views = {profiling.safe_name(view) for view in options['view']}
+
+        paths = {}
+        for output_format, extension in profiling.EXTENSIONS.items():
+            paths[output_format] = [
+                path
+                for path in sorted(glob.glob(os.path.join(directory, '*' + extension)))
+                if not views or profiling.view_name_from_path(path) in views
+            ]
+        if not any(paths.values()):
+            raise CommandError(f'No profiles found in {directory}.')
+
+        report = io.StringIO()
+        if paths[profiling.FORMAT_COLLAPSED]:
+            # the view is the root frame, so one flamegraph shows all views
+            stacks = Counter()
+            for path in paths[profiling.FORMAT_COLLAPSED]:
+                view = profiling.view_name_from_path(path)
+                for stack, count in profiling.read_collapsed(path).items():
+                    stacks[f'{view};{stack}'] += count
+            for stack, count in stacks.most_common():
+                report.write(f'{stack} {count}\n')
+
+        if paths[profiling.FORMAT_PSTATS]:
+            stats = pstats.Stats(*paths[profiling.FORMAT_PSTATS], stream=report)
+            stats.strip_dirs().sort_stats(options['sort'])
+            stats.print_stats(options['limit'])
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(report.getvalue())
+        else:
+            self.stdout.write(report.getvalue(), ending='')
+
+        count = sum(len(p) for p in paths.values())
+        self.stderr.write(f'Aggregated {count} profiles.')
+        if options['delete']:
+            for path in (p for group in paths.values() for p in group):
+                os.remove(path)
@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from devices.models import RateLimitBucket
+from devices.ratelimit import get_outbound_rate_limits
+
+
+class Command(BaseCommand):
+    help = (
+        'Shows the shared outbound rate limit buckets: the tokens available '
+        'now and how often callers had to wait for them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit', type=int, default=10,
+            help='Number of most throttled devices shown (default: 10).'
+        )
+        parser.add_argument(
+            '--prune', type=float, metavar='HOURS',
+            help='Delete the buckets unused for HOURS hours instead.'
+        )
+
+    def handle(self, *args, **options):
+        now = time.time()
+        if options['prune'] is not None:
+            deleted, _ = RateLimitBucket.objects.filter(
+                updated_at__lt=now - options['prune'] * 3600
+            ).delete()
+            self.stdout.write(f'Deleted {deleted} buckets.')
+            return
+
+        limits = get_outbound_rate_limits()
+        marketplaces = RateLimitBucket.objects.filter(
+            key__startswith='marketplace:'
+        ).order_by('key')
+        devices = RateLimitBucket.objects.filter(
+            key__startswith='device:', throttled__gt=0
+        ).order_by('-throttled')[:options['limit']]
+
+        for title, scope, buckets in (
+            ('Marketplaces', 'marketplace', marketplaces),
+            ('Most throttled devices', 'device', devices),
+        ):
+            if not limits.get(scope):
+                self.stdout.write(f'{title}: no limit')
+                continue
+            rate, capacity = limits[scope]
+            self.stdout.write(f'{title} ({rate:g}/s, burst {capacity:g}):')
+            for bucket in buckets:
+                available = min(
+                    capacity, bucket.tokens + (now - bucket.updated_at) * rate
+                )
+                self.stdout.write(
+                    f'  {bucket.key:<40} {available:6.1f} tokens, '
+                    f'throttled {bucket.throttled} times'
+                )
@@ -0,0 +1,30 @@
+import sqlite3
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from core.routers import get_replica_alias
+
+
+class Command(BaseCommand):
+    help = (
+        'Copies the SQLite primary database into the SQLite replica, to '
+        'try the replica routing locally.'
+    )
+
+    def handle(self, *args, **options):
+        alias = get_replica_alias()
+        if alias is None:
+            raise CommandError('No replica configured, see REPLICA_DATABASE.')
+
+        databases = (
+            connections[DEFAULT_DB_ALIAS].settings_dict,
+            connections[alias].settings_dict,
+        )
+        if any(db['ENGINE'] != 'django.db.backends.sqlite3' for db in databases):
+            raise CommandError('Primary and replica must be SQLite databases.')
+
+        primary, replica = (str(db['NAME']) for db in databases)
+        with sqlite3.connect(primary) as source, sqlite3.connect(replica) as target:
+            source.backup(target)
+        self.stdout.write(f'Copied {primary} to {replica}.')
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.7 on 2026-10-19 16:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0002_auto_20210930_1418'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audibledevice',
+            name='health_checked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='audibledevice',
+            name='health_status',
+            field=models.CharField(choices=[('unknown', 'Not checked'), ('ok', 'Valid'), ('invalid', 'Invalid'), ('error', 'Check failed')], default='unknown', max_length=10),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.2.7 on 2026-10-19 16:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0003_audibledevice_health'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bearertoken',
+            name='access_token_expires',
+            field=models.DateTimeField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='deviceinfo',
+            name='device_serial_number',
+            field=models.CharField(db_index=True, max_length=50),
+        ),
+        migrations.AddIndex(
+            model_name='audibledevice',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='device_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='audibledevice',
+            index=models.Index(fields=['user', 'country_code'], name='device_user_country_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='audibledevice',
+            index=models.Index(fields=['-created_at', '-id'], name='device_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='audibledevice',
+            index=models.Index(fields=['health_status', 'health_checked_at'], name='device_health_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='websitecookie',
+            index=models.Index(fields=['device', 'name'], name='websitecookie_device_name_idx'),
+        ),
+    ]
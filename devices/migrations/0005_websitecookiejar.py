@@ -0,0 +1,27 @@
+# Generated by Django 3.2.7 on 2026-10-19 16:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0004_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebsiteCookieJar',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('country_code', models.CharField(max_length=5)),
+                ('cookies', models.JSONField(default=dict)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='website_cookie_jars', to='devices.audibledevice')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='websitecookiejar',
+            constraint=models.UniqueConstraint(fields=('device', 'country_code'), name='websitecookiejar_device_country_uniq'),
+        ),
+    ]
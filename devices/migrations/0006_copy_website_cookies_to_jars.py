@@ -0,0 +1,48 @@
+from django.db import migrations
+
+
+BATCH_SIZE = 1000
+
+
+def copy_cookies_to_jars(apps, schema_editor):
+    WebsiteCookie = apps.get_model('devices', 'WebsiteCookie')
+    WebsiteCookieJar = apps.get_model('devices', 'WebsiteCookieJar')
+    db_alias = schema_editor.connection.alias
+
+    rows = WebsiteCookie.objects.using(db_alias).order_by(
+        'device_id', 'country_code', 'id'
+    ).values_list('device_id', 'country_code', 'name', 'value')
+
+    jars = []
+    current = None
+    for device_id, country_code, name, value in rows.iterator():
+        if current is None or (current.device_id, current.country_code) != (
+                device_id, country_code):
+            current = WebsiteCookieJar(
+                device_id=device_id, country_code=country_code, cookies={}
+            )
+            jars.append(current)
+        current.cookies[name] = value
+
+        if len(jars) > BATCH_SIZE:
+            WebsiteCookieJar.objects.using(db_alias).bulk_create(jars[:-1])
+            jars = jars[-1:]
+
+    WebsiteCookieJar.objects.using(db_alias).bulk_create(jars)
+
+
+def delete_jars(apps, schema_editor):
+    WebsiteCookieJar = apps.get_model('devices', 'WebsiteCookieJar')
+    db_alias = schema_editor.connection.alias
+    WebsiteCookieJar.objects.using(db_alias).all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0005_websitecookiejar'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_cookies_to_jars, delete_jars),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.7 on 2026-10-19 16:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0006_copy_website_cookies_to_jars'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audibledevice',
+            name='api_calls',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='audibledevice',
+            name='download_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='audibledevice',
+            name='last_used_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='audibledevice',
+            name='refresh_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
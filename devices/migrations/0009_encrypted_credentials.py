@@ -0,0 +1,62 @@
+# Generated by Django 3.2.7 on 2026-10-19 16:44
+
+import devices.fields
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0008_ratelimitbucket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kek_id', models.CharField(max_length=16)),
+                ('wrapped_key', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'get_latest_by': 'created_at',
+            },
+        ),
+        migrations.AlterField(
+            model_name='bearertoken',
+            name='access_token',
+            field=devices.fields.EncryptedTextField(max_length=500, validators=[django.core.validators.RegexValidator(regex='^Atna\\|.*$'), django.core.validators.MaxLengthValidator(500)]),
+        ),
+        migrations.AlterField(
+            model_name='bearertoken',
+            name='refresh_token',
+            field=devices.fields.EncryptedTextField(max_length=500, validators=[django.core.validators.RegexValidator(regex='^Atnr\\|.*$'), django.core.validators.MaxLengthValidator(500)]),
+        ),
+        migrations.AlterField(
+            model_name='messageauthenticationcode',
+            name='adp_token',
+            field=devices.fields.EncryptedTextField(max_length=1800, validators=[django.core.validators.RegexValidator(regex='^{enc:.*}{key:.*}{iv:.*}{name:.*}{serial:Mg==}$'), django.core.validators.MaxLengthValidator(1800)]),
+        ),
+        migrations.AlterField(
+            model_name='messageauthenticationcode',
+            name='device_cert',
+            field=devices.fields.EncryptedTextField(max_length=2000),
+        ),
+        migrations.AlterField(
+            model_name='storeauthenticationcookie',
+            name='cookie',
+            field=devices.fields.EncryptedTextField(max_length=300, validators=[django.core.validators.MaxLengthValidator(300)]),
+        ),
+        migrations.AlterField(
+            model_name='websitecookie',
+            name='value',
+            field=devices.fields.EncryptedTextField(),
+        ),
+        migrations.AlterField(
+            model_name='websitecookiejar',
+            name='cookies',
+            field=devices.fields.EncryptedJSONField(default=dict),
+        ),
+    ]
@@ -0,0 +1,157 @@
+import base64
+import hashlib
+import os
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, ExpressionWrapper, F, Value, When
+
+
+ENCRYPTED_FIELDS = [
+    ('BearerToken', ['access_token', 'refresh_token']),
+    ('MessageAuthenticationCode', ['adp_token', 'device_cert']),
+    ('StoreAuthenticationCookie', ['cookie']),
+    ('WebsiteCookie', ['value']),
+    ('WebsiteCookieJar', ['cookies']),
+]
+BATCH_SIZE = 500
+
+# A copy of the format of core.crypto at the time of this migration, the
+# live module and fields may change.
+PREFIX = 'enc1$'
+NONCE_SIZE = 12
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _key_encryption_keys():
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+    keys = [
+        _b64decode(key)
+        for key in getattr(settings, 'FIELD_ENCRYPTION_KEYS', None) or []
+    ]
+    if not keys:
+        keys = [HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=b'myaudible field encryption'
+        ).derive(settings.SECRET_KEY.encode())]
+    return {hashlib.sha256(key).hexdigest()[:8]: key for key in keys}
+
+
+def _seal(cipher, data):
+    nonce = os.urandom(NONCE_SIZE)
+    return nonce + cipher.encrypt(nonce, data, None)
+
+
+def _open(cipher, data):
+    return cipher.decrypt(data[:NONCE_SIZE], data[NONCE_SIZE:], None)
+
+
+def _raw_values(Model, db_alias, fields):
+    # the stored text, without the conversions of the encrypted fields
+    raw = {
+        f'raw_{field}': ExpressionWrapper(
+            F(field), output_field=models.TextField()
+        )
+        for field in fields
+    }
+    return Model.objects.using(db_alias).annotate(**raw).values_list(
+        'pk', *raw
+    ).order_by('pk').iterator()
+
+
+def _update(Model, db_alias, fields, rows):
+    # QuerySet.update() with text values, bulk_update() would encrypt them
+    # again with the live fields
+    updates = {}
+    for index, field in enumerate(fields):
+        updates[field] = Case(
+            *[
+                When(pk=pk, then=Value(values[index]))
+                for pk, values in rows.items()
+            ],
+            default=F(field),
+            output_field=models.TextField()
+        )
+    Model.objects.using(db_alias).filter(pk__in=rows).update(**updates)
+
+
+def _migrate_values(apps, db_alias, convert):
+    for model_name, fields in ENCRYPTED_FIELDS:
+        Model = apps.get_model('devices', model_name)
+        rows = {}
+        for pk, *values in _raw_values(Model, db_alias, fields):
+            converted = [convert(value) for value in values]
+            if converted == values:
+                continue
+            rows[pk] = converted
+            if len(rows) == BATCH_SIZE:
+                _update(Model, db_alias, fields, rows)
+                rows = {}
+        if rows:
+            _update(Model, db_alias, fields, rows)
+
+
+def encrypt_credentials(apps, schema_editor):
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    DataKey = apps.get_model('devices', 'DataKey')
+    db_alias = schema_editor.connection.alias
+    data_key = {}
+
+    def encrypt(value):
+        if value is None or value.startswith(PREFIX):
+            return value
+        if not data_key:
+            kek_id, kek = next(iter(_key_encryption_keys().items()))
+            key = AESGCM.generate_key(bit_length=256)
+            data_key['id'] = DataKey.objects.using(db_alias).create(
+                kek_id=kek_id, wrapped_key=_seal(AESGCM(kek), key)
+            ).pk
+            data_key['cipher'] = AESGCM(key)
+        data = _seal(data_key['cipher'], value.encode())
+        return f"{PREFIX}{data_key['id']}${_b64encode(data)}"
+
+    _migrate_values(apps, db_alias, encrypt)
+
+
+def decrypt_credentials(apps, schema_editor):
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    DataKey = apps.get_model('devices', 'DataKey')
+    db_alias = schema_editor.connection.alias
+    keks = _key_encryption_keys()
+    ciphers = {}
+
+    def decrypt(value):
+        if value is None or not value.startswith(PREFIX):
+            return value
+        key_id, data = value[len(PREFIX):].split('$', 1)
+        if key_id not in ciphers:
+            key = DataKey.objects.using(db_alias).get(pk=key_id)
+            kek = AESGCM(keks[key.kek_id])
+            ciphers[key_id] = AESGCM(_open(kek, bytes(key.wrapped_key)))
+        return _open(ciphers[key_id], _b64decode(data)).decode()
+
+    _migrate_values(apps, db_alias, decrypt)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0009_encrypted_credentials'),
+    ]
+
+    operations = [
+        migrations.RunPython(encrypt_credentials, decrypt_credentials),
+    ]
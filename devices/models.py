@@ -1,13 +1,75 @@
 from datetime import datetime, timezone
 
+from core import health
+from core.login import LOGIN_STAGE_SECONDS
+from core.marketplaces import Marketplace
 from core.utils import get_data_from_uploaded_auth_file
+from . import cache as device_cache
+from .fields import EncryptedJSONField, EncryptedTextField
 
 from django.conf import settings
 from django.db import models, transaction
 from django.core.validators import RegexValidator, MaxLengthValidator
 
 
+COOKIE_STORAGE_ROWS = 'rows'
+COOKIE_STORAGE_DOCUMENT = 'document'
+
+
+def get_website_cookie_storage():
+    """Returns how website cookies are stored, see WEBSITE_COOKIE_STORAGE.
+
+    ``rows`` keeps one `WebsiteCookie` per cookie, ``document`` keeps all
+    cookies of a device and marketplace in one `WebsiteCookieJar`.
+    """
+    return getattr(settings, 'WEBSITE_COOKIE_STORAGE', COOKIE_STORAGE_ROWS)
+
+
+class AudibleDeviceQuerySet(models.QuerySet):
+    # credential columns which are large and never shown on a page
+    SECRET_FIELDS = (
+        'bearer__access_token',
+        'bearer__refresh_token',
+        'mac_dms__adp_token',
+        'mac_dms__device_cert',
+        'store_cookie__cookie',
+    )
+
+    def for_display(self):
+        """Loads all related rows of the devices without the credentials."""
+        if get_website_cookie_storage() == COOKIE_STORAGE_DOCUMENT:
+            cookies = models.Prefetch(
+                'website_cookie_jars',
+                queryset=WebsiteCookieJar.objects.defer('cookies')
+            )
+        else:
+            cookies = models.Prefetch(
+                'website_cookies',
+                queryset=WebsiteCookie.objects.defer('value')
+            )
+
+        return self.select_related(
+            'device_info', 'customer_info', 'bearer', 'mac_dms', 'store_cookie'
+        ).defer(*self.SECRET_FIELDS).prefetch_related(cookies)
+
+    def with_credentials(self):
+        if get_website_cookie_storage() == COOKIE_STORAGE_DOCUMENT:
+            cookies = 'website_cookie_jars'
+        else:
+            cookies = 'website_cookies'
+
+        return self.select_related(
+            'device_info', 'customer_info', 'bearer', 'mac_dms', 'store_cookie'
+        ).prefetch_related(cookies)
+
+
 class AudibleDevice(models.Model):
+    HEALTH_UNKNOWN = health.HEALTH_UNKNOWN
+    HEALTH_OK = health.HEALTH_OK
+    HEALTH_INVALID = health.HEALTH_INVALID
+    HEALTH_ERROR = health.HEALTH_ERROR
+    HEALTH_CHOICES = health.HEALTH_CHOICES
+
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         related_name='audible_devices',
@@ -16,9 +78,40 @@ class AudibleDevice(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     last_modified = models.DateTimeField(auto_now=True)
     country_code = models.CharField(max_length=5)
+    health_status = models.CharField(
+        max_length=10,
+        choices=HEALTH_CHOICES,
+        default=HEALTH_UNKNOWN
+    )
+    health_checked_at = models.DateTimeField(null=True, blank=True)
+    # written in batches by devices.usage, not on every use
+    last_used_at = models.DateTimeField(null=True, blank=True)
+    api_calls = models.PositiveIntegerField(default=0)
+    refresh_count = models.PositiveIntegerField(default=0)
+    download_count = models.PositiveIntegerField(default=0)
+
+    objects = AudibleDeviceQuerySet.as_manager()
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(
+                fields=['user', '-created_at', '-id'],
+                name='device_user_created_idx'
+            ),
+            models.Index(
+                fields=['user', 'country_code'],
+                name='device_user_country_idx'
+            ),
+            models.Index(
+                fields=['-created_at', '-id'],
+                name='device_created_idx'
+            ),
+            models.Index(
+                fields=['health_status', 'health_checked_at'],
+                name='device_health_idx'
+            ),
+        ]
 
     def __str__(self):
         if hasattr(self, 'device_info'):
@@ -60,22 +153,118 @@ class AudibleDevice(models.Model):
             cookie=data.get('store_authentication_cookie',{}).get('cookie')
         )
     
-        with transaction.atomic():
-            device.save()
-            bearer.save()
-            customer_info.save()
-            device_info.save()
-            mac_dms.save()
-            store_cookie.save()
-    
-        for name, value in data.get('website_cookies', {}).items():
-            device.website_cookies.create(
-                country_code=data.get('locale_code'),
-                name=name,
-                value=value
-            )
+        db_write_timer = LOGIN_STAGE_SECONDS.time(
+            stage='db_write', marketplace=device.country_code
+        )
+        related = [bearer, customer_info, device_info, mac_dms, store_cookie]
+        with db_write_timer, transaction.atomic():
+            with device_cache.batch_invalidation():
+                device.save()
+                for obj in related:
+                    # assign again with the pk, saving an instance whose
+                    # device_id changes drops the cached device
+                    obj.device = device
+                    obj.save()
+                device.set_website_cookies(
+                    data.get('website_cookies', {}), data.get('locale_code')
+                )
+
+        return device
+
+    def get_website_cookies_dict(self, country_code=None):
+        """Returns the website cookies for a marketplace as name/value dict.
+
+        Uses prefetched cookies if available, otherwise a single query.
+        """
+        country_code = country_code or self.country_code
+        if get_website_cookie_storage() == COOKIE_STORAGE_DOCUMENT:
+            for jar in self.website_cookie_jars.all():
+                if jar.country_code == country_code:
+                    return dict(jar.cookies)
+            return {}
+
+        return {
+            cookie.name: cookie.value
+            for cookie in self.website_cookies.all()
+            if cookie.country_code == country_code
+        }
+
+    def get_website_cookies(self, country_code=None):
+        """Returns the website cookies for a marketplace as cookie jar."""
+        import httpx
 
-        return cls
+        country_code = country_code or self.country_code
+        domain = Marketplace.from_country_code(country_code).domain
+        jar = httpx.Cookies()
+        for name, value in self.get_website_cookies_dict(country_code).items():
+            jar.set(name, value, domain=f'.amazon.{domain}')
+        return jar
+
+    def get_website_cookie_countries(self):
+        """Returns the marketplaces with stored website cookies."""
+        if get_website_cookie_storage() == COOKIE_STORAGE_DOCUMENT:
+            cookies = self.website_cookie_jars.all()
+        else:
+            cookies = self.website_cookies.all()
+        return sorted({cookie.country_code for cookie in cookies})
+
+    def set_website_cookies(self, cookies, country_code=None):
+        """Replaces the website cookies for a marketplace."""
+        country_code = country_code or self.country_code
+        if get_website_cookie_storage() == COOKIE_STORAGE_DOCUMENT:
+            # update first, a device gets its jar only once
+            updated = WebsiteCookieJar.objects.filter(
+                device=self, country_code=country_code
+            ).update(cookies=cookies)
+            if not updated:
+                WebsiteCookieJar.objects.create(
+                    device=self, country_code=country_code, cookies=cookies
+                )
+        else:
+            with transaction.atomic():
+                self.website_cookies.filter(
+                    country_code=country_code
+                ).delete()
+                WebsiteCookie.objects.bulk_create([
+                    WebsiteCookie(
+                        device=self,
+                        country_code=country_code,
+                        name=name,
+                        value=value
+                    )
+                    for name, value in cookies.items()
+                ])
+        # update(), delete() and bulk_create() send no post_save signal
+        device_cache.invalidate_users([self.user_id])
+
+    def to_auth_dict(self):
+        """Returns the credentials in the format of an auth file.
+
+        Use ``AudibleDevice.objects.with_credentials()`` to load everything
+        needed in one go.
+        """
+        return {
+            'adp_token': self.mac_dms.adp_token,
+            'device_private_key': self.mac_dms.device_cert,
+            'access_token': self.bearer.access_token,
+            'refresh_token': self.bearer.refresh_token,
+            'expires': self.bearer.access_token_expires.timestamp(),
+            'website_cookies': self.get_website_cookies_dict(),
+            'store_authentication_cookie': {'cookie': self.store_cookie.cookie},
+            'device_info': {
+                'device_name': self.device_info.device_name,
+                'device_serial_number': self.device_info.device_serial_number,
+                'device_type': self.device_info.device_type
+            },
+            'customer_info': {
+                'account_pool': self.customer_info.account_pool,
+                'user_id': self.customer_info.user_id,
+                'home_region': self.customer_info.home_region,
+                'name': self.customer_info.name,
+                'given_name': self.customer_info.given_name
+            },
+            'locale_code': self.country_code
+        }
 
     @classmethod
     def create_from_file_import(cls, file, password, user):
@@ -91,15 +280,15 @@ class BearerToken(models.Model):
         on_delete=models.CASCADE,
         primary_key=True
     )
-    access_token = models.TextField(
+    access_token = EncryptedTextField(
         max_length=500,
         validators=[
             RegexValidator(regex=r'^Atna\|.*$'),
             MaxLengthValidator(500)
         ]
     )
-    access_token_expires = models.DateTimeField()
-    refresh_token = models.TextField(
+    access_token_expires = models.DateTimeField(db_index=True)
+    refresh_token = EncryptedTextField(
         max_length=500,
         validators=[
             RegexValidator(regex=r'^Atnr\|.*$'),
@@ -130,7 +319,7 @@ class DeviceInfo(models.Model):
         primary_key=True
     )
     device_name = models.CharField(max_length=100)
-    device_serial_number = models.CharField(max_length=50)
+    device_serial_number = models.CharField(max_length=50, db_index=True)
     device_type = models.CharField(max_length=20)
 
 
@@ -140,7 +329,7 @@ class MessageAuthenticationCode(models.Model):
         related_name='mac_dms',
         on_delete=models.CASCADE,
         primary_key=True)
-    adp_token = models.TextField(
+    adp_token = EncryptedTextField(
         max_length=1800,
         validators=[
             RegexValidator(
@@ -149,7 +338,7 @@ class MessageAuthenticationCode(models.Model):
             MaxLengthValidator(1800)
         ]
     )
-    device_cert = models.TextField(max_length=2000)
+    device_cert = EncryptedTextField(max_length=2000)
 
 
 class StoreAuthenticationCookie(models.Model):
@@ -159,7 +348,7 @@ class StoreAuthenticationCookie(models.Model):
         on_delete=models.CASCADE,
         primary_key=True
     )
-    cookie = models.TextField(
+    cookie = EncryptedTextField(
         max_length=300,
         validators=[
             MaxLengthValidator(300)
@@ -175,5 +364,56 @@ class WebsiteCookie(models.Model):
     )
     country_code = models.CharField(max_length=5)
     name = models.CharField(max_length=30)
-    value = models.TextField()
+    value = EncryptedTextField()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['device', 'name'],
+                name='websitecookie_device_name_idx'
+            ),
+        ]
+
+
+class WebsiteCookieJar(models.Model):
+    device = models.ForeignKey(
+        AudibleDevice,
+        on_delete=models.CASCADE,
+        related_name='website_cookie_jars'
+    )
+    country_code = models.CharField(max_length=5)
+    cookies = EncryptedJSONField(default=dict)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['device', 'country_code'],
+                name='websitecookiejar_device_country_uniq'
+            ),
+        ]
+
+
+class RateLimitBucket(models.Model):
+    """Token bucket of the outbound rate limiter, shared by all workers."""
+    key = models.CharField(max_length=100, unique=True)
+    tokens = models.FloatField()
+    # time.time() of the last refill
+    updated_at = models.FloatField()
+    # number of times a caller had to wait for this bucket
+    throttled = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.key
+
+
+class DataKey(models.Model):
+    """Data key of the encrypted fields, wrapped by a key encryption key."""
+    kek_id = models.CharField(max_length=16)
+    wrapped_key = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        get_latest_by = 'created_at'
+
+    def __str__(self):
+        return f'{self.pk} ({self.kek_id})'
@@ -0,0 +1,267 @@
+import base64
+import datetime
+import json
+from typing import Any, List, Optional, Sequence
+
+from django.core.paginator import EmptyPage, Page, Paginator
+from django.db import connections
+from django.db.models import F, Q
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def _json_default(value: Any) -> str:
+    # keep the full precision, DjangoJSONEncoder cuts off microseconds
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+
+class KeysetPage:
+    def __init__(
+        self,
+        object_list: List[Any],
+        next_cursor: Optional[str],
+        previous_cursor: Optional[str]
+    ) -> None:
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<KeysetPage with {len(self.object_list)} objects>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    def has_previous(self) -> bool:
+        return self.previous_cursor is not None
+
+    def has_other_pages(self) -> bool:
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """Paginates a queryset by the values of its ordering fields.
+
+    Instead of an ``OFFSET``, every page is fetched with a ``WHERE`` clause
+    which starts right after (or before) the row the cursor points to. This
+    keeps the cost of a page constant, no matter how deep it is. The last
+    ordering field must be unique (e.g. ``id``) to make the order total.
+    NULL values of nullable fields (also across reverse relations) sort
+    before all other values on every database backend.
+    """
+
+    def __init__(
+        self,
+        queryset,
+        ordering: Sequence[str],
+        per_page: int
+    ) -> None:
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        self._fields = []
+        self._nullable = []
+        for name in self.ordering:
+            field, nullable = self._resolve_field(queryset.model, name.lstrip('-'))
+            self._fields.append(field)
+            self._nullable.append(nullable)
+        self.queryset = queryset.order_by(*self._order_by(self.ordering))
+
+    @staticmethod
+    def _resolve_field(model, path: str):
+        nullable = False
+        for part in path.split('__'):
+            field = model._meta.get_field(part)
+            # reverse relations are joined with LEFT OUTER JOIN
+            nullable = nullable or field.null
+            model = field.related_model
+        return field, nullable
+
+    def _order_by(self, ordering: Sequence[str]) -> List[Any]:
+        order_by = []
+        for name, nullable in zip(ordering, self._nullable):
+            if not nullable:
+                order_by.append(name)
+            elif name.startswith('-'):
+                order_by.append(F(name[1:]).desc(nulls_last=True))
+            else:
+                order_by.append(F(name).asc(nulls_first=True))
+        return order_by
+
+    @staticmethod
+    def _get_value(obj: Any, path: str) -> Any:
+        for part in path.split('__'):
+            obj = getattr(obj, part, None)
+        return obj
+
+    def encode_cursor(self, obj: Any) -> str:
+        values = [
+            self._get_value(obj, name.lstrip('-')) for name in self.ordering
+        ]
+        data = json.dumps(values, default=_json_default).encode()
+        return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+    def decode_cursor(self, cursor: str) -> List[Any]:
+        try:
+            data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            values = json.loads(data)
+            if len(values) != len(self.ordering):
+                raise ValueError('cursor does not match ordering')
+            return [
+                field.to_python(value)
+                for field, value in zip(self._fields, values)
+            ]
+        except Exception as exc:
+            raise InvalidCursor(f'Invalid cursor {cursor!r}') from exc
+
+    @staticmethod
+    def _equal(name: str, value: Any) -> Q:
+        if value is None:
+            return Q(**{f'{name}__isnull': True})
+        return Q(**{name: value})
+
+    @staticmethod
+    def _beyond(name: str, value: Any, descending: bool, nullable: bool) -> Q:
+        # rows after `value` in the direction of the ordering, NULL first
+        if value is None:
+            # nothing sorts before NULL
+            return Q(pk__in=[]) if descending else Q(**{f'{name}__isnull': False})
+        if descending:
+            term = Q(**{f'{name}__lt': value})
+            if nullable:
+                term |= Q(**{f'{name}__isnull': True})
+            return term
+        return Q(**{f'{name}__gt': value})
+
+    def _seek(self, values: List[Any], reverse: bool) -> Q:
+        # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+        condition = Q()
+        for index, name in enumerate(self.ordering):
+            descending = name.startswith('-') != reverse
+            term = self._beyond(
+                name.lstrip('-'), values[index], descending,
+                self._nullable[index]
+            )
+            for prev_name, value in zip(self.ordering[:index], values):
+                term &= self._equal(prev_name.lstrip('-'), value)
+            condition |= term
+        return condition
+
+    def page(
+        self,
+        after: Optional[str] = None,
+        before: Optional[str] = None
+    ) -> KeysetPage:
+        qs = self.queryset
+        if before:
+            values = self.decode_cursor(before)
+            reversed_ordering = [
+                name[1:] if name.startswith('-') else f'-{name}'
+                for name in self.ordering
+            ]
+            qs = qs.filter(self._seek(values, reverse=True))
+            qs = qs.order_by(*self._order_by(reversed_ordering))
+        elif after:
+            qs = qs.filter(self._seek(self.decode_cursor(after), reverse=False))
+
+        rows = list(qs[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if before:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, bool(after)
+
+        return KeysetPage(
+            object_list=rows,
+            next_cursor=self.encode_cursor(rows[-1]) if has_next and rows else None,
+            previous_cursor=(
+                self.encode_cursor(rows[0]) if has_previous and rows else None
+            )
+        )
+
+
+class EstimatedPage(Page):
+    """A page of :class:`EstimatedCountPaginator` which knows by an extra
+    fetched row if another page follows."""
+
+    def __init__(self, object_list, number, paginator, has_more):
+        super().__init__(object_list, number, paginator)
+        self._has_more = has_more
+
+    def has_next(self):
+        return self._has_more
+
+    def end_index(self):
+        return self.start_index() + len(self) - 1 if len(self) else 0
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator which avoids counting all rows of large tables.
+
+    On PostgreSQL the row count of an unfiltered queryset is taken from the
+    planner statistics. Otherwise rows are only counted up to `count_limit`.
+    If the count is not exact, pages are fetched without relying on it, so
+    pages beyond the limit are still reachable by their page number.
+    """
+
+    count_limit = 10000
+
+    def _estimate_count(self) -> Optional[int]:
+        qs = self.object_list
+        connection = connections[qs.db]
+        if connection.vendor != 'postgresql' or qs.query.where:
+            return None
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE relname = %s',
+                [qs.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        return int(row[0]) if row else None
+
+    @cached_property
+    def count(self) -> int:
+        estimate = self._estimate_count()
+        if estimate is not None and estimate > self.count_limit:
+            return estimate
+        return self.object_list.values('pk')[:self.count_limit].count()
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            # the count is not exact, let the query decide if the page exists
+            if int(number) > self.num_pages and self.is_estimated:
+                return int(number)
+            raise
+
+    @property
+    def is_estimated(self) -> bool:
+        return self.count >= self.count_limit
+
+    def page(self, number):
+        if not self.is_estimated:
+            return super().page(number)
+
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        # one more row tells if there is a next page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage('That page contains no results')
+        has_more = len(rows) > self.per_page
+        return EstimatedPage(rows[:self.per_page], number, self, has_more)
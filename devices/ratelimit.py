@@ -0,0 +1,141 @@
+"""Outbound rate limits shared by all workers.
+
+Every call to Amazon on behalf of a stored device takes a token from the
+bucket of the device and from the bucket of its marketplace domain. The
+buckets are rows of :class:`~devices.models.RateLimitBucket`, so the limits
+hold for all processes using the database together, not per process like
+:class:`core.api.MarketplaceRateLimiter`.
+
+A token is taken with a single UPDATE, which is atomic on every database
+backend. An empty bucket goes into debt instead of refusing the token: the
+caller gets the next free slot and sleeps until then, so waiting callers
+never poll the database and the calls leave at exactly the allowed rate.
+
+The async API takes the tokens in a worker thread with its own database
+connection, so it must not be used while the calling thread holds a write
+transaction on SQLite.
+"""
+import asyncio
+import time
+from typing import Dict, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Greatest, Least
+
+from core import metrics
+from .models import RateLimitBucket
+
+
+OUTBOUND_THROTTLED = metrics.counter(
+    'myaudible_outbound_throttled_total',
+    'Outbound Amazon calls which had to wait for a rate limit.',
+    ['scope']
+)
+OUTBOUND_WAIT_SECONDS = metrics.histogram(
+    'myaudible_outbound_wait_seconds',
+    'Time outbound Amazon calls waited for the rate limits.',
+    buckets=(0.0, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+
+
+def get_outbound_rate_limits() -> Dict[str, Tuple[float, float]]:
+    """Returns requests per second and burst size per scope, a scope
+    without limit is not throttled."""
+    return dict(getattr(settings, 'OUTBOUND_RATE_LIMITS', {}))
+
+
+class SharedRateLimiter:
+    """Token buckets per device and per marketplace domain in the database."""
+
+    def __init__(self, limits: Optional[Dict] = None) -> None:
+        self.limits = limits or get_outbound_rate_limits()
+        self._known_keys = set()
+
+    def get_buckets(self, domain: str, device_id=None):
+        """Returns the buckets of a call as {key: (scope, rate, capacity)}."""
+        scopes = {f'marketplace:{domain}': 'marketplace'}
+        if device_id is not None:
+            scopes[f'device:{device_id}'] = 'device'
+        return {
+            key: (scope, *self.limits[scope])
+            for key, scope in scopes.items()
+            if self.limits.get(scope)
+        }
+
+    def _create_buckets(self, buckets, now: float) -> None:
+        missing = [key for key in buckets if key not in self._known_keys]
+        if not missing:
+            return
+        RateLimitBucket.objects.bulk_create(
+            [
+                RateLimitBucket(
+                    key=key, tokens=buckets[key][2], updated_at=now
+                )
+                for key in missing
+            ],
+            ignore_conflicts=True
+        )
+        self._known_keys.update(missing)
+
+    def _take(self, key: str, rate: float, capacity: float, now: float):
+        # a caller with an older clock reading must not refill twice
+        elapsed = Greatest(Value(now) - F('updated_at'), Value(0.0))
+        refilled = Least(
+            Value(float(capacity)), F('tokens') + elapsed * Value(rate)
+        )
+        updated = RateLimitBucket.objects.filter(key=key).update(
+            tokens=refilled - Value(1.0),
+            updated_at=Greatest(F('updated_at'), Value(now)),
+            throttled=F('throttled') + Case(
+                When(tokens__lt=Value(1.0) - elapsed * Value(rate), then=1),
+                default=0
+            )
+        )
+        if not updated:
+            # pruned since it was created (``rate_limits --prune``)
+            self._known_keys.discard(key)
+            self._create_buckets({key: (None, rate, capacity)}, now)
+            return self._take(key, rate, capacity, now)
+        tokens = RateLimitBucket.objects.filter(key=key).values_list(
+            'tokens', flat=True
+        ).get()
+        return max(-tokens / rate, 0.0)
+
+    def reserve(self, domain: str, device_id=None) -> float:
+        """Takes a token from every bucket of the call.
+
+        Empty buckets go into debt, so every caller gets its own slot and
+        no caller has to poll. Returns the seconds to wait before the call.
+        """
+        buckets = self.get_buckets(domain, device_id)
+        now = time.time()
+        self._create_buckets(buckets, now)
+        waits = {}
+        with transaction.atomic():
+            # always the same order, so concurrent callers cannot deadlock
+            for key in sorted(buckets):
+                waits[key] = self._take(key, *buckets[key][1:], now)
+
+        for key, wait in waits.items():
+            if wait:
+                OUTBOUND_THROTTLED.inc(scope=buckets[key][0])
+        wait = max(waits.values(), default=0.0)
+        OUTBOUND_WAIT_SECONDS.observe(wait)
+        return wait
+
+    def acquire_sync(self, domain: str, device_id=None) -> float:
+        """Blocks until a call is allowed. Returns the time waited."""
+        wait = self.reserve(domain, device_id)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    async def acquire(self, domain: str, device_id=None) -> float:
+        """Waits until a call is allowed. Returns the time waited."""
+        wait = await sync_to_async(self.reserve)(domain, device_id)
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
@@ -1,12 +1,65 @@
-from django.contrib.sessions.models import Session
-from django.db.models.signals import pre_delete
+from django.contrib.auth.signals import user_logged_out
+from django.core.signals import request_finished
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
 from core.login import session_pool
+from core.sqlite import configure_connection
+from . import cache as device_cache
+from .models import (
+    AudibleDevice,
+    BearerToken,
+    CustomerInfo,
+    DeviceInfo,
+    MessageAuthenticationCode,
+    StoreAuthenticationCookie,
+    WebsiteCookie,
+    WebsiteCookieJar)
+from .usage import usage_tracker
 
 
-@receiver(pre_delete, sender=Session)
-def delete_login_session(sender, instance, **kwargs):
-    session_id = instance.session_key
-    session_pool.remove_session(session_id)
+connection_created.connect(configure_connection)
 
+
+# Login sessions of deleted Django sessions are removed by
+# session_pool.reconcile(). A delete receiver on Session would turn off the
+# bulk delete of clearsessions.
+@receiver(user_logged_out)
+def remove_login_session(sender, request, **kwargs):
+    session_pool.remove_session(request.session.session_key)
+
+
+@receiver(post_save, sender=AudibleDevice)
+@receiver(post_delete, sender=AudibleDevice)
+def invalidate_device_pages(sender, instance, **kwargs):
+    device_cache.invalidate_users([instance.user_id])
+
+
+# Only post_save is connected for the related models: a delete receiver would
+# turn off the fast cascade delete, and deleting the device already
+# invalidates the pages.
+@receiver(post_save, sender=BearerToken)
+@receiver(post_save, sender=CustomerInfo)
+@receiver(post_save, sender=DeviceInfo)
+@receiver(post_save, sender=MessageAuthenticationCode)
+@receiver(post_save, sender=StoreAuthenticationCookie)
+@receiver(post_save, sender=WebsiteCookie)
+@receiver(post_save, sender=WebsiteCookieJar)
+def invalidate_related_device_pages(sender, instance, **kwargs):
+    device = sender._meta.get_field('device').get_cached_value(instance, None)
+    if device is not None:
+        user_id = device.user_id
+    else:
+        user_id = AudibleDevice.objects.filter(
+            pk=instance.device_id
+        ).values_list('user_id', flat=True).first()
+    if user_id is not None:
+        device_cache.invalidate_users([user_id])
+
+
+@receiver(request_finished)
+def flush_device_usage(sender, **kwargs):
+    # the counters are written by the request which makes the batch due,
+    # the timer only runs for idle processes
+    usage_tracker.maybe_flush()
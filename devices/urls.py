@@ -1,6 +1,6 @@
 from django.urls import path
 
-from . import views
+from . import api, views
 
 
 urlpatterns = [
@@ -9,6 +9,14 @@ urlpatterns = [
     path('add-device/<uuid:login_uuid>/<path:resource>', views.register_device),
     path('add-device/<uuid:login_uuid>/', views.register_device),
     path('import-file/', views.ImportAuthFileView.as_view(), name='import_auth_file'),
+    path('deregister/', views.DeregisterDevicesView.as_view(), name='deregister_devices'),
+    path('metrics/', views.metrics_view, name='metrics'),
+    path('api/', api.device_list, name='api_device_list'),
+    path('api/credentials/', api.device_credentials, name='api_device_credentials'),
+    path('api/logins/', api.login_list, name='api_login_list'),
+    path('api/logins/<uuid:login_uuid>/', api.login_detail, name='api_login_detail'),
+    path('api/<int:pk>/', api.device_detail, name='api_device_detail'),
+    path('<int:pk>/credentials/', views.OwnDeviceCredentialsView.as_view(), name='own_device_credentials'),
     path('<int:pk>/', views.OwnDevicesDetailView.as_view(), name='own_device_detail'),
     path('', views.OwnDevicesListView.as_view(), name='own_devices_list')
 ]
@@ -0,0 +1,212 @@
+"""Write-behind usage counters of the devices.
+
+Every use of a device only updates counters in memory. The counters of
+all devices are written with a single UPDATE statement at most every
+DEVICE_USAGE_FLUSH_INTERVAL seconds (at the end of a request, or by a timer
+thread if no further request comes in), when DEVICE_USAGE_MAX_PENDING
+devices are pending and when the process exits. The timer and the exit hook
+only exist while counters are pending. The UPDATE adds to the stored
+values, so several processes can flush independently, and it does not
+touch ``last_modified``.
+
+Counters are only written to the database they were recorded for: after
+the test database is destroyed, they are dropped instead of being written
+to the development database.
+"""
+import atexit
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db import DatabaseError, connections, models, router
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from core import metrics
+from .models import AudibleDevice
+
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ('api_calls', 'refresh_count', 'download_count')
+
+USAGE_FLUSHES = metrics.counter(
+    'myaudible_device_usage_flushes_total',
+    'Batched writes of the device usage counters.',
+    ['result']
+)
+
+
+class UsageTracker:
+    def __init__(self, flush_interval=None, max_pending=None):
+        self._flush_interval = flush_interval
+        self._max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending: Dict[int, Dict] = {}
+        self._last_flush = time.monotonic()
+        self._timer: Optional[threading.Timer] = None
+        self._database: Optional[str] = None
+
+    @property
+    def flush_interval(self) -> float:
+        if self._flush_interval is not None:
+            return self._flush_interval
+        return getattr(settings, 'DEVICE_USAGE_FLUSH_INTERVAL', 30)
+
+    @property
+    def max_pending(self) -> int:
+        if self._max_pending is not None:
+            return self._max_pending
+        return getattr(settings, 'DEVICE_USAGE_MAX_PENDING', 1000)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def record(
+        self,
+        device_id: int,
+        api_calls: int = 0,
+        refresh_count: int = 0,
+        download_count: int = 0,
+        used_at=None
+    ) -> None:
+        """Counts a use of a device, flushes if the batch is due."""
+        used_at = used_at or timezone.now()
+        with self._lock:
+            if not self._pending:
+                self._database = self._database_name()
+            usage = self._pending.setdefault(
+                device_id, dict.fromkeys(COUNTERS, 0)
+            )
+            usage['api_calls'] += api_calls
+            usage['refresh_count'] += refresh_count
+            usage['download_count'] += download_count
+            last_used_at = usage.get('last_used_at')
+            if last_used_at is None or used_at > last_used_at:
+                usage['last_used_at'] = used_at
+            self._schedule_flush()
+        self.maybe_flush()
+
+    @staticmethod
+    def _database_name() -> str:
+        alias = router.db_for_write(AudibleDevice)
+        return connections[alias].settings_dict['NAME']
+
+    def _schedule_flush(self) -> None:
+        # called with the lock held
+        if self._timer is None:
+            self._timer = threading.Timer(
+                self.flush_interval, self._flush_from_timer
+            )
+            self._timer.daemon = True
+            self._timer.start()
+            atexit.register(self.flush)
+
+    def _cancel_flush(self) -> None:
+        # called with the lock held
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+            atexit.unregister(self.flush)
+
+    def _flush_from_timer(self) -> None:
+        with self._lock:
+            if self._timer is not threading.current_thread():
+                # cancelled by a flush which was already running
+                return
+            self._timer = None
+            atexit.unregister(self.flush)
+        try:
+            self.flush()
+        finally:
+            # the database connections of the timer thread
+            connections.close_all()
+
+    def maybe_flush(self) -> None:
+        if (
+            len(self._pending) >= self.max_pending
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self) -> Optional[int]:
+        """Writes all pending counters in one UPDATE.
+
+        Returns the number of updated devices. If the write fails the
+        counters are kept for the next flush.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            database = self._database
+            self._last_flush = time.monotonic()
+            self._cancel_flush()
+        if not pending:
+            return 0
+        if database != self._database_name():
+            logger.warning(
+                'Dropped the usage of %d devices, %s is no longer the '
+                'database', len(pending), database
+            )
+            return 0
+
+        updates = {
+            'last_used_at': Case(
+                *[
+                    When(pk=pk, then=Value(usage['last_used_at']))
+                    for pk, usage in pending.items()
+                ],
+                output_field=models.DateTimeField()
+            )
+        }
+        for name in COUNTERS:
+            increments = [
+                When(pk=pk, then=Value(usage[name]))
+                for pk, usage in pending.items() if usage[name]
+            ]
+            if increments:
+                updates[name] = F(name) + Case(
+                    *increments,
+                    default=Value(0),
+                    output_field=models.PositiveIntegerField()
+                )
+
+        try:
+            # QuerySet.update() leaves the auto_now field alone
+            updated = AudibleDevice.objects.filter(pk__in=pending).update(
+                **updates
+            )
+        except DatabaseError:
+            logger.exception('Writing the device usage failed')
+            USAGE_FLUSHES.inc(result='error')
+            self._restore(pending, database)
+            return None
+
+        USAGE_FLUSHES.inc(result='ok')
+        return updated
+
+    def _restore(self, pending, database):
+        with self._lock:
+            if not self._pending:
+                self._database = database
+            self._schedule_flush()
+            for device_id, usage in pending.items():
+                current = self._pending.get(device_id)
+                if current is None:
+                    self._pending[device_id] = usage
+                    continue
+                for name in COUNTERS:
+                    current[name] += usage[name]
+                current['last_used_at'] = max(
+                    current['last_used_at'], usage['last_used_at']
+                )
+
+
+usage_tracker = UsageTracker()
+
+metrics.gauge(
+    'myaudible_device_usage_pending',
+    'Devices with usage counters not yet written in this process.',
+    function=lambda: len(usage_tracker)
+)
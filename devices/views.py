@@ -1,22 +1,45 @@
+import hmac
+import math
+
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.messages import get_messages
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.messages.views import SuccessMessageMixin
-from django.http import Http404, HttpResponse
+from django.http import Http404, HttpResponse, JsonResponse
 from django.urls import reverse
+from django.utils.cache import (
+    add_never_cache_headers,
+    get_conditional_response,
+    patch_cache_control)
+from django.utils.decorators import method_decorator
+from django.utils.http import http_date, quote_etag
 from django.shortcuts import redirect
 from django.views.generic import FormView
 from django.views.generic.detail import DetailView
 from django.views.generic.list import ListView
+from django.views.decorators.cache import never_cache
 from django.views.decorators.csrf import csrf_exempt
 
-from .forms import AudibleCreateLoginForm, AuthFileImportForm
+from . import cache as device_cache
+from .forms import (
+    AudibleCreateLoginForm,
+    AuthFileImportForm,
+    DeregisterDevicesForm)
+from .jobs import deregister_devices
 from .models import AudibleDevice
+from .pagination import InvalidCursor, KeysetPaginator
+from .usage import usage_tracker
+from core import metrics, routers
 from core.login import session_pool
+from core.routers import pin_to_primary
+from core.marketplaces import get_marketplaces_choices
 
 
 @csrf_exempt
 def register_device(request, login_uuid, resource=None, *args, **kwargs):
     s_obj = session_pool.get_session_by_uuid(login_uuid)
-    if not s_obj:
+    if not s_obj or s_obj.is_expired:
         raise Http404('Login session does not exist.')
 
     if resource:
@@ -35,7 +58,9 @@ def register_device(request, login_uuid, resource=None, *args, **kwargs):
             data=registration_data,
             user=request.user
         )
-        session_pool.remove_session(login_uuid)
+        # the login may end with a GET, show the new device from the primary
+        pin_to_primary(request)
+        session_pool.remove_session(s_obj.session_key)
         return redirect('own_devices_list')
 
     status = s_obj.session._last_response.status_code
@@ -59,6 +84,7 @@ class RegisterDeviceView(LoginRequiredMixin, FormView):
         session_key = self.request.session.session_key
         if session_key in session_pool:
             session_pool.remove_session(session_key)
+        session_pool.maybe_reconcile()
 
         return super().get(request, *args, **kwargs)
 
@@ -99,21 +125,217 @@ class ImportAuthFileView(LoginRequiredMixin, SuccessMessageMixin, FormView):
         return redirect('own_devices_list')
 
 
-class OwnDevicesListView(LoginRequiredMixin, ListView):
+class CachedPageMixin:
+    """Serves the rendered page from the per-user device cache.
+
+    The version of the user's devices is also the validator for
+    conditional requests, so an unchanged page is answered with
+    304 Not Modified without rendering.
+    """
+
+    cache_page_name = None
+
+    def get(self, request, *args, **kwargs):
+        # pages with pending messages must not be replayed from the cache
+        if len(get_messages(request)):
+            response = super().get(request, *args, **kwargs)
+            add_never_cache_headers(response)
+            return response
+
+        user_id = request.user.pk
+        version = device_cache.get_user_version(user_id)
+        parts = (
+            self.cache_page_name,
+            sorted(kwargs.items()),
+            request.GET.urlencode(),
+            # shown in the navbar and not part of the version
+            request.user.get_username()
+        )
+        etag = quote_etag(device_cache.etag(user_id, *parts, version=version))
+        # whole seconds, rounded up so that the page is never newer than
+        # its Last-Modified; clients sending ETags get exact revalidation
+        last_modified = math.ceil(device_cache.version_timestamp(version))
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = self.get_page(
+                device_cache.page_key(user_id, *parts, version=version),
+                request, *args, **kwargs
+            )
+
+        if response.status_code in (200, 304):
+            # a page read from a lagging replica may be older than version
+            if response.status_code == 304 or not routers.reads_from_replica():
+                response['ETag'] = etag
+                response['Last-Modified'] = http_date(last_modified)
+            # browsers may keep the page but have to revalidate it
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def get_page(self, key, request, *args, **kwargs):
+        content = device_cache.get_page(key)
+        if content is not None:
+            return HttpResponse(content)
+
+        response = super().get(request, *args, **kwargs)
+        response.render()
+        if response.status_code == 200 and not routers.reads_from_replica():
+            device_cache.set_page(key, response.content)
+        return response
+
+
+class DeregisterDevicesView(LoginRequiredMixin, FormView):
+    form_class = DeregisterDevicesForm
+    template_name = 'devices/deregister-devices.html'
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['user'] = self.request.user
+        return kwargs
+
+    def get_initial(self):
+        initial = super().get_initial()
+        initial['devices'] = self.request.GET.getlist('devices')
+        return initial
+
+    def form_valid(self, form):
+        cd = form.cleaned_data
+        devices = AudibleDevice.objects.filter(
+            pk__in=[device.pk for device in cd['devices']],
+            user=self.request.user
+        )
+
+        deleted, errors = deregister_devices(devices, force=cd['force'])
+
+        messages.success(self.request, f'{deleted} devices deregistered')
+        if errors:
+            messages.warning(
+                self.request,
+                f'{len(errors)} devices could not be deregistered'
+            )
+        return redirect('own_devices_list')
+
+
+class OwnDevicesListView(LoginRequiredMixin, CachedPageMixin, ListView):
 
     model = AudibleDevice
     template_name = 'devices/audible-devices-list.html'
+    cache_page_name = 'list'
+    paginate_by = 25
+    sort_options = {
+        'newest': ('-created_at', '-id'),
+        'oldest': ('created_at', 'id'),
+        'name': ('device_info__device_name', 'id'),
+        'marketplace': ('country_code', '-created_at', '-id'),
+    }
+
+    def get_sort(self):
+        sort = self.request.GET.get('sort')
+        return sort if sort in self.sort_options else 'newest'
 
     def get_queryset(self):
         qs = super().get_queryset()
-        return qs.filter(user=self.request.user)
+        qs = qs.filter(user=self.request.user).select_related(
+            'device_info', 'customer_info'
+        )
+
+        marketplace = self.request.GET.get('marketplace')
+        if marketplace:
+            qs = qs.filter(country_code=marketplace)
+        name = self.request.GET.get('q')
+        if name:
+            qs = qs.filter(device_info__device_name__icontains=name)
+
+        return qs
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(
+            queryset, self.sort_options[self.get_sort()], page_size
+        )
+        try:
+            page = paginator.page(
+                after=self.request.GET.get('after'),
+                before=self.request.GET.get('before')
+            )
+        except InvalidCursor:
+            raise Http404('Invalid page cursor.')
+
+        return paginator, page, page.object_list, page.has_other_pages()
 
+    def get_page_query(self, **params):
+        query = self.request.GET.copy()
+        for key in ('after', 'before'):
+            query.pop(key, None)
+        query.update(params)
+        return query.urlencode()
 
-class OwnDevicesDetailView(LoginRequiredMixin, DetailView):
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        page = context['page_obj']
+        if page.has_next():
+            context['next_page_query'] = self.get_page_query(
+                after=page.next_cursor
+            )
+        if page.has_previous():
+            context['previous_page_query'] = self.get_page_query(
+                before=page.previous_cursor
+            )
+        context['marketplaces'] = get_marketplaces_choices()
+        context['sort_options'] = list(self.sort_options)
+        context['current_sort'] = self.get_sort()
+        return context
+
+
+class OwnDevicesDetailView(LoginRequiredMixin, CachedPageMixin, DetailView):
 
     model = AudibleDevice
     template_name = 'devices/audible-device-detail.html'
+    cache_page_name = 'detail'
 
     def get_queryset(self):
         qs = super().get_queryset()
-        return qs.filter(user=self.request.user)
+        return qs.filter(user=self.request.user).for_display()
+
+
+@method_decorator(never_cache, name='dispatch')
+class OwnDeviceCredentialsView(LoginRequiredMixin, DetailView):
+    """Downloads the credentials of a device as auth file."""
+
+    model = AudibleDevice
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        return qs.filter(user=self.request.user).with_credentials()
+
+    def render_to_response(self, context, **response_kwargs):
+        device = self.object
+        usage_tracker.record(device.pk, download_count=1)
+        response = JsonResponse(
+            device.to_auth_dict(), json_dumps_params={'indent': 4}
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="audible-device-{device.pk}.json"'
+        )
+        return response
+
+
+def metrics_view(request):
+    """Exposes the metrics of this process in the Prometheus text format."""
+    if not getattr(settings, 'METRICS_ENABLED', False):
+        raise Http404()
+
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if not token:
+        if not settings.DEBUG:
+            return HttpResponse('METRICS_TOKEN is not set', status=403)
+    elif not hmac.compare_digest(
+        request.headers.get('Authorization', '').encode(),
+        f'Bearer {token}'.encode()
+    ):
+        return HttpResponse('Unauthorized', status=401)
+
+    return HttpResponse(
+        metrics.REGISTRY.expose(), content_type=metrics.CONTENT_TYPE
+    )
@@ -14,6 +14,7 @@ import os
 from pathlib import Path
 
 from django.contrib.messages import constants as messages
+from django.core.exceptions import ImproperlyConfigured
 
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -58,6 +59,9 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.ReplicaMiddleware',
+    'core.middleware.QueryProfilerMiddleware',
+    'core.middleware.CPUProfilerMiddleware',
 ]
 
 ROOT_URLCONF = 'myaudible.urls'
@@ -88,9 +92,161 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # seconds a connection waits for a lock of another worker
+            'timeout': 20,
+        },
+    }
+}
+
+# Production mode for SQLite: WAL journal, synchronous=NORMAL and a larger
+# page cache and memory map on every connection, writers wait for the lock
+# up to the 'timeout' in OPTIONS above. Compare with ``manage.py
+# benchmark_sqlite``. Override single pragmas in SQLITE_PRAGMAS.
+
+SQLITE_PRODUCTION = os.environ.get(
+    'MYAUDIBLE_SQLITE_PRODUCTION', str(not DEBUG)
+).lower() in ('1', 'true', 'yes')
+SQLITE_PRAGMAS = {}
+
+# Optional read replica for the read-only views in REPLICA_VIEWS. Try it
+# locally with a copy of the SQLite file (``manage.py sync_sqlite_replica``)
+# and MYAUDIBLE_REPLICA_DB=db-replica.sqlite3. Users are pinned to the
+# primary for REPLICA_PIN_SECONDS after their devices changed, the pins are
+# kept in the default cache (shared by all workers only with a shared cache).
+
+if os.environ.get('MYAUDIBLE_REPLICA_DB'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / os.environ['MYAUDIBLE_REPLICA_DB'],
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+REPLICA_DATABASE = 'replica'
+REPLICA_PIN_SECONDS = 10
+REPLICA_VIEWS = [
+    'own_devices_list',
+    'own_device_detail',
+    'admin:devices_audibledevice_changelist',
+    'api_device_list',
+    'api_device_detail',
+    'api_device_credentials',
+]
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# The device pages are invalidated through the cache. LocMemCache only
+# works for a single process: with more than one worker use a shared
+# backend (e.g. FileBasedCache or Memcached) for DEVICES_CACHE_ALIAS,
+# otherwise other workers serve outdated pages (``manage.py check --deploy``
+# warns with devices.W001).
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'myaudible',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
     }
 }
 
+DEVICES_CACHE_ALIAS = 'default'
+DEVICES_CACHE_TIMEOUT = 600
+
+# 'document' stores all website cookies of a device and marketplace in one
+# WebsiteCookieJar row, 'rows' uses one WebsiteCookie row per cookie
+WEBSITE_COOKIE_STORAGE = 'document'
+
+# The usage counters of the devices (last use, API calls, token refreshes,
+# downloads) are collected per process and written in one UPDATE every
+# DEVICE_USAGE_FLUSH_INTERVAL seconds or after DEVICE_USAGE_MAX_PENDING
+# devices.
+DEVICE_USAGE_FLUSH_INTERVAL = 30
+DEVICE_USAGE_MAX_PENDING = 1000
+
+# Requests per second and burst size of the calls to Amazon made for stored
+# devices (health checks, deregistrations), per marketplace domain and per
+# device. Shared by all workers through the database, inspect them with
+# ``manage.py rate_limits``. A scope without limit is not throttled.
+OUTBOUND_RATE_LIMITS = {
+    'marketplace': (10.0, 20),
+    'device': (1.0, 5),
+}
+
+# The credentials of the devices are stored encrypted with data keys, which
+# are wrapped by the first of FIELD_ENCRYPTION_KEYS (comma separated in
+# MYAUDIBLE_FIELD_ENCRYPTION_KEYS, create one with ``manage.py
+# encryption_keys --generate``). Older keys stay in the list until
+# ``manage.py encryption_keys --rewrap`` ran. Only with DEBUG on the keys
+# may be missing, one is derived from SECRET_KEY then. A new data key is
+# created every FIELD_ENCRYPTION_DATA_KEY_MAX_AGE seconds.
+FIELD_ENCRYPTION_KEYS = [
+    key for key in os.environ.get(
+        'MYAUDIBLE_FIELD_ENCRYPTION_KEYS', ''
+    ).split(',') if key
+]
+if not FIELD_ENCRYPTION_KEYS and not DEBUG:
+    raise ImproperlyConfigured(
+        'Set MYAUDIBLE_FIELD_ENCRYPTION_KEYS, create a key with '
+        '"manage.py encryption_keys --generate" (works with DEBUG on).'
+    )
+FIELD_ENCRYPTION_DATA_KEY_MAX_AGE = 30 * 24 * 60 * 60
+
+
+# Metrics of the login proxy in the Prometheus text format at
+# /devices/metrics/, turned on with MYAUDIBLE_METRICS_ENABLED. Scrapers have
+# to send METRICS_TOKEN as bearer token, without a token the metrics are only
+# served with DEBUG on. The values are per worker process.
+
+METRICS_ENABLED = os.environ.get(
+    'MYAUDIBLE_METRICS_ENABLED', ''
+).lower() in ('1', 'true', 'yes')
+METRICS_TOKEN = os.environ.get('MYAUDIBLE_METRICS_TOKEN')
+
+
+# Transport factory for the requests of the device login to Amazon. Use
+# 'core.standin.standin_transport' to log in against a local stand-in
+# (see ``manage.py benchmark_login``), 'core.standin.recording_transport'
+# or 'core.standin.replay_transport' to record or replay the flows in the
+# AUDIBLE_LOGIN_RECORDING file.
+
+AUDIBLE_LOGIN_TRANSPORT = os.environ.get('MYAUDIBLE_LOGIN_TRANSPORT')
+AUDIBLE_LOGIN_RECORDING = os.path.join(BASE_DIR, 'login-recording.jsonl')
+
+# Open logins of the API (POST /devices/api/logins/) per user and process.
+HEADLESS_LOGINS_PER_USER = 3
+
+
+# Sampled SQL profiling of requests. Requests above one of the limits are
+# logged by the 'core.middleware' logger with their repeated statements.
+# Off by default, set MYAUDIBLE_QUERY_PROFILER_RATE to 1 to profile every
+# request while developing or e.g. to 0.01 to profile 1% in production.
+
+QUERY_PROFILER = {
+    'SAMPLE_RATE': float(os.environ.get('MYAUDIBLE_QUERY_PROFILER_RATE', 0.0)),
+    'MAX_QUERIES': 20,
+    'MAX_TIME': 0.5,
+    'MAX_REPEATS': 5,
+}
+
+
+# Sampled CPU profiling of requests, one profile file per request in
+# DIRECTORY. Aggregate them with ``manage.py profile_report``.
+
+CPU_PROFILER = {
+    'SAMPLE_RATE': float(os.environ.get('MYAUDIBLE_CPU_PROFILER_RATE', 0.0)),
+    'VIEWS': [
+        'devices.views.register_device',
+        'audible_add_device',
+        'import_auth_file',
+    ],
+    'DIRECTORY': os.path.join(BASE_DIR, 'profiles'),
+    'FORMAT': 'collapsed',
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -134,6 +290,14 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, "static"),
 ]
 
+# ``manage.py collectstatic`` writes the files with a content hash in their
+# name and .gz/.br variants (.br needs the brotli package) to STATIC_ROOT.
+# With SERVE_STATIC, Django serves them itself with immutable cache headers.
+
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+STATICFILES_STORAGE = 'core.staticfiles.CompressedManifestStaticFilesStorage'
+SERVE_STATIC = not DEBUG
+
 MEDIA_URL = '/media/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')